@@ -0,0 +1,93 @@
+import asyncio
+import shlex
+import subprocess
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Generator, Hashable, NamedTuple, Tuple
+
+
+class InFlight:
+    """
+    Deduplicates concurrent requests: while a coroutine for a given key is running,
+    all the other callers with the same key await its result instead of starting a new one.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Tuple[Any, Hashable], asyncio.Future] = {}
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable]):
+        # tasks are bound to an event loop
+        key = asyncio.get_event_loop(), key
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(partial(self._forget, key))
+
+        # a cancelled caller must not cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+
+async def run_blocking(func: Callable, *args, **kwargs):
+    """ Run a blocking `func` in the default executor """
+    return await asyncio.get_event_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+
+class IO(NamedTuple):
+    """ A blocking call and its non-blocking counterpart, which take the same `args` """
+    func: Callable
+    afunc: Callable[..., Awaitable]
+    args: tuple
+
+    @classmethod
+    def blocking(cls, func: Callable, *args) -> 'IO':
+        """ A call that has no non-blocking counterpart, so it is made in the default executor """
+        return cls(func, partial(run_blocking, func), args)
+
+
+# the logic, which is shared by the sync and async methods, is written as a generator that yields the `IO` requests,
+# so that only the way they are performed differs
+
+
+def run_io(steps: Generator[IO, Any, Any]):
+    """ Run the `steps` making the blocking calls. Returns the value returned by the generator """
+    send, value = steps.send, None
+    while True:
+        try:
+            request = send(value)
+        except StopIteration as e:
+            return e.value
+
+        # the errors are raised inside the generator, so that it can handle them
+        try:
+            send, value = steps.send, request.func(*request.args)
+        except Exception as e:
+            send, value = steps.throw, e
+
+
+async def arun_io(steps: Generator[IO, Any, Any]):
+    """ Same as `run_io`, but doesn't block the event loop """
+    send, value = steps.send, None
+    while True:
+        try:
+            request = send(value)
+        except StopIteration as e:
+            return e.value
+
+        try:
+            send, value = steps.send, await request.afunc(*request.args)
+        except Exception as e:
+            send, value = steps.throw, e
+
+
+async def call_git_async(command: str, cwd) -> str:
+    """ Same as `call_git`, but doesn't block the event loop """
+    process = await asyncio.create_subprocess_exec(
+        *shlex.split(command), cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    output, _ = await process.communicate()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, output)
+    return output.decode('utf-8').strip()
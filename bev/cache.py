@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, Callable, Hashable, NamedTuple, Optional
+
+from .hash import CompactTree, load_tree
+
+
+class DiskCache:
+    """
+    A persistent key-value cache for JSON-serializable values.
+
+    Each value is stored in a separate file which is written to a temporary location and then atomically moved,
+    so concurrent readers and writers never see partially written entries. All the errors are silently ignored:
+    the cache is only an optimization and a read-only or missing location simply disables it.
+
+    If `max_size` is given, the least recently used entries are removed, once the files take more than
+    `max_size` bytes on disk.
+    """
+
+    def __init__(self, root: Path, max_size: Optional[int] = None):
+        self.root, self.max_size = Path(root), max_size
+        # the number of bytes written since the last cleanup. None - if there was no cleanup yet
+        self._written = None
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        path = self._path(key)
+        with suppress(OSError, ValueError):
+            value = self._load(path)
+            if self.max_size is not None:
+                # the modification time tracks the last access
+                with suppress(OSError):
+                    os.utime(path)
+            return value
+
+        return default
+
+    def set(self, key: str, value: Any):
+        with suppress(OSError):
+            content = self._dump(value)
+            write_atomic(self._path(key), content)
+            self._account(len(content))
+
+    def cleanup(self):
+        """ Remove the least recently used entries, until they take no more than 3/4 of `max_size` """
+        if self.max_size is None:
+            return
+
+        entries = []
+        with suppress(OSError):
+            for folder in os.scandir(self.root):
+                with suppress(OSError):
+                    for entry in os.scandir(folder.path):
+                        with suppress(OSError):
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime, _disk_usage(stat), entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_size * 3 // 4:
+                break
+            with suppress(OSError):
+                os.remove(path)
+                total -= size
+
+    def _load(self, path: Path) -> Any:
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def _dump(self, value: Any) -> bytes:
+        return json.dumps(value).encode('utf-8')
+
+    def _account(self, size: int):
+        if self.max_size is None:
+            return
+        with self._lock:
+            # small files still take whole blocks
+            written = (self._written or 0) + -(-size // 4096) * 4096
+            # the folder is shared with other processes, so it's checked at least once by each of them
+            cleanup = self._written is None or written > self.max_size // 16
+            self._written = 0 if cleanup else written
+        if cleanup:
+            self.cleanup()
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.root / digest[:2] / digest[2:]
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+    weight: int
+
+
+class LRUCache:
+    """
+    A thread-safe in-memory cache with least-recently-used eviction.
+
+    The cache is bounded by the total `weight` of its values, which is computed by `weigh`: by default each value
+    weighs 1, so `max_weight` is simply the maximal number of entries. `None` means no limit.
+    """
+
+    def __init__(self, max_weight: Optional[int], weigh: Optional[Callable[[Any], int]] = None):
+        self.max_weight = max_weight
+        self._weigh = weigh or (lambda value: 1)
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+        self._weight = self.hits = self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._values:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key][0]
+
+    def set(self, key: Hashable, value: Any):
+        weight = self._weigh(value)
+        with self._lock:
+            self._pop(key)
+            # the value doesn't fit at all
+            if self.max_weight is not None and weight > self.max_weight:
+                return
+
+            self._values[key] = value, weight
+            self._weight += weight
+            while self.max_weight is not None and self._weight > self.max_weight:
+                self._pop(next(iter(self._values)))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._weight = self.hits = self.misses = 0
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, len(self._values), self._weight)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._values
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.set(key, value)
+
+    def __len__(self):
+        return len(self._values)
+
+    def _pop(self, key):
+        if key in self._values:
+            self._weight -= self._values.pop(key)[1]
+
+
+class TreeImages(DiskCache):
+    """
+    Binary images of the parsed trees, kept in the `root` folder.
+
+    The images are memory-mapped, so all the processes on the same node share the same physical pages,
+    instead of each of them keeping a private copy of the same tree.
+    """
+
+    def load(self, path: Path) -> CompactTree:
+        """ Load the tree stored at `path` from its image, creating the image if needed """
+        # the storage is content-addressed, so an image never goes stale
+        key = str(Path(path).absolute())
+        tree = self.get(key)
+        if tree is None:
+            tree = load_tree(path)
+            if not tree.is_mapped:
+                self.set(key, tree)
+                tree = self.get(key, tree)
+        return tree
+
+    def _load(self, path: Path) -> CompactTree:
+        return CompactTree.from_file(path)
+
+    def _dump(self, tree: CompactTree) -> bytes:
+        return tree.to_bytes()
+
+
+def user_cache_dir() -> Path:
+    """
+    The folder for bev's own persistent caches: `$XDG_CACHE_HOME/bev` or `~/.cache/bev`.
+    It only speeds things up, so it can be safely removed at any moment.
+    """
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path('~/.cache').expanduser()) / 'bev'
+
+
+def write_atomic(path: Path, content: bytes):
+    """ Write the `content` to a temporary file, which is then atomically moved to `path` """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp')
+    try:
+        # `mkstemp` creates private files, but the folder might be shared
+        os.chmod(tmp, os.stat(path.parent).st_mode & 0o666)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def _disk_usage(stat: os.stat_result) -> int:
+    blocks = getattr(stat, 'st_blocks', None)
+    return stat.st_size if blocks is None else blocks * 512
+
+
+def tree_footprint(tree: dict) -> int:
+    """ Approximate memory footprint of a possibly nested tree in bytes """
+    if not isinstance(tree, dict):
+        return sys.getsizeof(tree)
+    return sys.getsizeof(tree) + sum(sys.getsizeof(k) + tree_footprint(v) for k, v in tree.items())
+
+
+_missing = object()
@@ -2,6 +2,7 @@ import json
 import os
 import shutil
 from collections import OrderedDict
+from collections.abc import Mapping
 from pathlib import Path
 from typing import List, Optional
 
@@ -10,7 +11,7 @@ from rich.progress import track
 from tqdm.auto import tqdm
 
 from ..exceptions import HashError
-from ..hash import is_hash, to_hash
+from ..hash import get_from_tree, is_hash, is_tree, load_key, load_tree, strip_tree, to_hash, update_tree
 from ..interface import Repository
 from ..ops import Conflict, gather, load_hash, save_hash
 from ..utils import PathOrStr, deprecate
@@ -48,10 +49,11 @@ def add(
             # TODO: warn
             continue
 
-        _gather_and_write(source, destination, keep, conflict, repo.storage)
+        _gather_and_write(source, destination, keep, conflict, repo.storage, repo.tree_format, repo.nested_trees)
 
 
-def _gather_and_write(source: PathOrStr, destination: PathOrStr, keep: bool, conflict: Conflict, storage):
+def _gather_and_write(source: PathOrStr, destination: PathOrStr, keep: bool, conflict: Conflict, storage,
+                      tree_format: str = 'json', nested: bool = False):
     source, destination = Path(source), Path(destination)
     previous = None
     if destination.exists():
@@ -62,28 +64,45 @@ def _gather_and_write(source: PathOrStr, destination: PathOrStr, keep: bool, con
             raise HashError(f'The destination "{destination}" is not a file')
 
         if conflict != Conflict.replace:
-            previous = load_hash(destination, storage)
+            previous = load_key(destination)
 
     current = gather(source, storage, track)
     if previous is not None:
-        if isinstance(current, dict):
-            if not isinstance(previous, dict):
+        if isinstance(current, Mapping):
+            if not is_tree(previous):
                 raise HashError(f'The previous version ({destination}) is not a folder')
 
+            # a nested tree can be updated without loading all of it
+            incremental = nested and all(
+                len(Path(path).parts) == 1 for path in storage.read(load_tree, strip_tree(previous), fetch=False)
+            )
+            # each touched subtree is loaded only once during the whole update
+            trees = {}
+            if incremental:
+                def get_previous(path):
+                    return get_from_tree(storage, previous, path, fetch=False, trees=trees)
+            else:
+                previous = load_hash(destination, storage)
+                get_previous = previous.get
+
             if conflict == Conflict.update:
-                for k in set(current) & set(previous):
-                    if current[k] != previous[k]:
+                for k in current:
+                    old = get_previous(k)
+                    if old is not None and current[k] != old:
                         raise HashError(
-                            f'The current ({current[k][:6]}...) and previous ({previous[k][:6]}...) '
+                            f'The current ({current[k][:6]}...) and previous ({old[:6]}...) '
                             f'versions do not match for "{k}", which is required for the "update" '
                             'conflict resolution'
                         )
 
-            previous.update(current)
-            current = previous
+            if incremental:
+                current = update_tree(previous, current, storage, tree_format, fetch=False, trees=trees)
+            else:
+                # the loaded trees are read-only
+                current = {**previous, **current}
 
         else:
-            if not isinstance(previous, str):
+            if is_tree(previous):
                 raise HashError(f'The previous version ({destination}) is not a file')
 
             if conflict == Conflict.update and current != previous:
@@ -92,7 +111,7 @@ def _gather_and_write(source: PathOrStr, destination: PathOrStr, keep: bool, con
                     f'versions do not match, which is required for the "update" conflict resolution'
                 )
 
-    save_hash(current, destination, storage)
+    save_hash(current, destination, storage, tree_format, nested)
 
     if not keep:
         if source.is_dir():
@@ -4,16 +4,21 @@ from pathlib import Path
 import typer
 from tqdm.auto import tqdm
 
-from ..hash import from_hash, is_hash
+from ..hash import from_hash, get_from_tree, is_hash, is_tree, to_hash
 from ..shortcuts import get_current_repo
 from ..utils import call_git
+from ..vc import CatFile
 from .app import app_command
 
 
 @app_command
 def blame(
         path: Path = typer.Argument(..., help='Path to the hash'),
-        relative: str = typer.Argument(..., help='The relative path inside the hashed folder')
+        relative: str = typer.Argument(..., help='The relative path inside the hashed folder'),
+        bisect: bool = typer.Option(
+            False, help='Use binary search over the history. Assumes that the value changed only once, '
+                        'and is used only if the history is linear'
+        ),
 ):
     """Find the closest version which introduced a change to a value RELATIVE to the PATH"""
 
@@ -24,25 +29,77 @@ def blame(
     folder = path
     if is_hash(folder):
         folder = from_hash(folder)
+    else:
+        path = to_hash(path)
     base = repo.get_key(folder, relative, version=repo.latest_version())
 
-    idx = 0
-    bar = tqdm()
-    while True:
-        idx += 1
-        output = call_git(f'git log -n 1 --skip {idx} --pretty=format:%H,%ct -- {path}', repo.root, True)
-        if not output:
-            break
-
-        commit, time = output.split(',', 1)
-        bar.update()
-        bar.set_description_str(str(datetime.fromtimestamp(int(time))))
-
-        current = repo.load_tree(path, commit)
-        if relative not in current or current[relative] != base:
-            bar.close()
-            print(call_git(f"git log --format='%an <%ae> at %aD' {commit}^!", repo.root, True))
-            return
-
-    bar.close()
-    print(call_git(f"git log -n 1 --format='%an <%ae> at %aD' -- {path}", repo.root, True))
+    # the whole history of the hash in a single call: commit, time, parents
+    history = [
+        line.split() for line in
+        call_git(f'git log --format="%H %ct %P" -- ./{path}', repo.root, True).splitlines()
+    ]
+    if not history:
+        # e.g. the path is a folder inside another hashed folder
+        print(f'The hash "{path}" has no history')
+        raise typer.Exit(255)
+
+    cat_file, values = CatFile(repo.root), {}
+
+    def read_keys(indices):
+        # only the hash file is read for each commit
+        return [
+            obj.content.decode('utf-8').strip() if obj is not None and obj.kind == 'blob' else None
+            for obj in cat_file.read_many([f'{history[idx][0]}:./{path}' for idx in indices])
+        ]
+
+    def get_value(key):
+        # the trees are loaded only when the hash changes, and we keep only the target entry
+        if key not in values:
+            values[key] = None
+            if key is not None and is_tree(key):
+                values[key] = get_from_tree(repo.storage, key, relative, fetch=repo.fetch)
+
+        return values[key]
+
+    def describe(idx):
+        bar.set_description_str(str(datetime.fromtimestamp(int(history[idx][1]))))
+
+    def linear_search(batch_size=256):
+        for start in range(0, len(history), batch_size):
+            indices = range(start, min(start + batch_size, len(history)))
+            describe(start)
+            for idx, key in zip(indices, read_keys(indices)):
+                if get_value(key) != base:
+                    return idx
+                bar.update()
+
+        return len(history)
+
+    def binary_search():
+        start, stop = 0, len(history)
+        while start < stop:
+            middle = (start + stop) // 2
+            describe(middle)
+            bar.update()
+            if get_value(read_keys([middle])[0]) == base:
+                start = middle + 1
+            else:
+                stop = middle
+
+        return start
+
+    # bisection makes sense only if there is a single line of changes
+    linear = all(len(entry) <= 3 for entry in history)
+    try:
+        if bisect and linear:
+            with tqdm(total=len(history).bit_length()) as bar:
+                idx = binary_search()
+        else:
+            with tqdm(total=len(history)) as bar:
+                idx = linear_search()
+    finally:
+        cat_file.close()
+
+    # the oldest commit that still has the current value is the one that introduced it
+    commit = history[max(idx - 1, 0)][0]
+    print(call_git(f"git log --format='%an <%ae> at %aD' {commit}^!", repo.root, True))
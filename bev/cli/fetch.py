@@ -5,7 +5,7 @@ import typer
 from rich.progress import track
 
 from ..exceptions import HashError
-from ..hash import from_hash, is_hash, is_tree, load_key, load_tree, strip_tree, to_hash
+from ..hash import from_hash, is_hash, is_tree, load_key, read_tree, strip_tree, to_hash
 from ..interface import Repository
 from ..shortcuts import get_consistent_repo
 from ..utils import HashNotFound
@@ -16,7 +16,7 @@ def _fetch(repo: Repository, path: Path):
     key = load_key(path)
     if is_tree(key):
         key = strip_tree(key)
-        keys = sorted(set(map(bytes.fromhex, repo.storage.read(load_tree, key, fetch=True).values())))
+        keys = sorted(set(map(bytes.fromhex, read_tree(repo.storage, key, fetch=True).values())))
     else:
         keys = [bytes.fromhex(key)]
 
@@ -1,6 +1,7 @@
 import os
 import shutil
 import warnings
+from collections.abc import Mapping
 from enum import Enum
 from pathlib import Path
 from typing import List, Optional
@@ -92,7 +93,7 @@ def _pull(source, destination, mode, keep, repo, fetch):
         return p
 
     h = load_hash(source, repo.storage, fetch)
-    if isinstance(h, dict):
+    if isinstance(h, Mapping):
         if destination.is_file():
             raise cli_error(
                 OSError,
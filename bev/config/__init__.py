@@ -3,4 +3,4 @@ from .hostname import *
 from .include import *
 from .parse import *
 from .remote import *
-from .utils import CONFIG, find_repo_root, find_vcs_root
+from .utils import CONFIG, find_repo_configs, find_repo_root, find_vcs_root
@@ -177,8 +177,12 @@ class ConfigMeta(NoExtra):
     order: str = None
     hash: Union[str, HashConfig] = None
     include: Sequence[Include] = ()
+    # the encoding of the new trees: json or binary
+    tree_format: str = None
+    # whether the new trees store each subfolder as a separate tree
+    nested_trees: bool = None
 
-    _override = 'fallback', 'order', 'choose', 'hash'
+    _override = 'fallback', 'order', 'choose', 'hash', 'tree_format', 'nested_trees'
 
     @validator('hash', pre=True)
     def normalize_hash(cls, v):
@@ -192,6 +196,12 @@ class ConfigMeta(NoExtra):
             v = v,
         return v
 
+    @validator('tree_format')
+    def known_format(cls, v):
+        if v is not None and v not in ('json', 'binary'):
+            raise ValueError(f'Unknown tree format: {v}')
+        return v
+
 
 class RepositoryConfig(NoExtra):
     local: StorageCluster
@@ -16,6 +16,10 @@ class Include:
     def read(self, parent: Union[Path, None]) -> Tuple[Union[Path, None], Union[dict, None]]:
         raise NotImplementedError
 
+    def resolve(self, parent: Union[Path, None]) -> Union[Path, None]:
+        """ The path at which the included config is expected, if it is known in advance """
+        return None
+
     @classmethod
     def __get_validators__(cls):
         yield cls.validate
@@ -39,6 +43,14 @@ class FileInclude(Include):
         super().__init__(Path(value).expanduser(), optional)
 
     def read(self, parent: Union[Path, None]) -> Tuple[Union[Path, None], Union[dict, None]]:
+        path = self.resolve(parent)
+        if path.exists():
+            with open(path, 'r') as file:
+                return path, safe_load(file)
+
+        return None, None
+
+    def resolve(self, parent: Union[Path, None]) -> Path:
         path = self.value
         if not path.is_absolute():
             if parent is None:
@@ -49,11 +61,7 @@ class FileInclude(Include):
 
             path = parent.parent / path
 
-        if path.exists():
-            with open(path, 'r') as file:
-                return path, safe_load(file)
-
-        return None, None
+        return path
 
 
 @register('module')
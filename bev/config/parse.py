@@ -1,6 +1,8 @@
 import importlib
+import os
+import threading
 from pathlib import Path
-from typing import Callable, NamedTuple, Sequence, Tuple
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
 
 from tarn import DiskDict, HashKeyStorage, Location
 from yaml import safe_load
@@ -16,13 +18,48 @@ class CacheStorageIndex(NamedTuple):
     storage: HashKeyStorage
 
 
-def load_config(config: Path) -> RepositoryConfig:
-    with open(config, 'r') as file:
-        return parse(Path(config), safe_load(file))
+class LoadedRepository(NamedTuple):
+    config: RepositoryConfig
+    storage: HashKeyStorage
+    cache: Optional[CacheStorageIndex]
+    # identifies the state of the config files
+    fingerprint: tuple
 
 
-def build_storage(root: Path) -> Tuple[HashKeyStorage, CacheStorageIndex]:
-    config = load_config(root / CONFIG)
+def load_config(config: Path, files: Optional[List[Path]] = None) -> RepositoryConfig:
+    with open(config, 'r') as file:
+        return parse(Path(config), safe_load(file), files)
+
+
+def load_repository(root: Path) -> LoadedRepository:
+    """
+    Load the config and build the storage for the repository located at `root`.
+
+    The result is shared by the whole process and is reused as long as the config and all the included files have
+    the same modification time and size, and the same optional storage locations exist.
+    """
+    path = Path(root).absolute() / CONFIG
+    # `BEV__REPOSITORY` affects the choice of the local storage
+    key = path, os.environ.get('BEV__REPOSITORY')
+    with _LOADED_LOCK:
+        entry = _LOADED.get(key)
+    if entry is not None:
+        files, locations, loaded = entry
+        if _fingerprint(files, locations) == loaded.fingerprint:
+            return loaded
+
+    files = [path]
+    config = load_config(path, files)
+    locations = _optional_locations(config)
+    loaded = LoadedRepository(config, *build_storage(root, config), _fingerprint(files, locations))
+    with _LOADED_LOCK:
+        _LOADED[key] = files, locations, loaded
+    return loaded
+
+
+def build_storage(root: Path, config: Optional[RepositoryConfig] = None) -> Tuple[HashKeyStorage, CacheStorageIndex]:
+    if config is None:
+        config = load_config(root / CONFIG)
     meta = config.meta
 
     order_func: Callable[[Sequence[Location]], Sequence[Location]] = identity
@@ -61,8 +98,8 @@ def filter_remotes(entries):
     return remotes
 
 
-def parse(root, config) -> RepositoryConfig:
-    meta, entries = _parse(root, config, root)
+def parse(root, config, files: Optional[List[Path]] = None) -> RepositoryConfig:
+    meta, entries = _parse(root, config, root, files)
 
     filter_func: Callable[[StorageCluster], bool] = default_choose
     if meta.choose is not None:
@@ -82,7 +119,7 @@ def parse(root, config) -> RepositoryConfig:
     return RepositoryConfig(local=local, remotes=remotes, meta=meta)
 
 
-def _parse(name, config, root):
+def _parse(name, config, root, files: Optional[List[Path]] = None):
     if not isinstance(config, dict):
         raise ConfigError(f'{name}: The config must be a dict')
 
@@ -107,10 +144,16 @@ def _parse(name, config, root):
         parent_root, parent_config = parent.read(root)
         if parent_config is None:
             if parent.optional:
+                # the file might appear later
+                missing = parent.resolve(root)
+                if files is not None and missing is not None:
+                    files.append(missing)
                 continue
             raise ConfigError(f'Parent config "{parent.value}" not found')
 
-        parent_meta, items = _parse(parent.value, parent_config, parent_root)
+        if files is not None and parent_root is not None:
+            files.append(parent_root)
+        parent_meta, items = _parse(parent.value, parent_config, parent_root, files)
         common = set(items) & set(entries)
         if common:
             raise ConfigError(f'{name}: Trying to override the names {common} from parent config {parent.value}')
@@ -130,3 +173,31 @@ def _parse(name, config, root):
 
     meta = meta.copy(update=override)
     return meta, entries
+
+
+def _optional_locations(config: RepositoryConfig) -> Tuple[Path, ...]:
+    clusters = [config.local, *config.remotes]
+    storages = [cluster.storage for cluster in clusters]
+    for cluster in clusters:
+        if cluster.cache is not None:
+            storages.extend([cluster.cache.storage, cluster.cache.index])
+    return tuple(
+        location.root for storage in storages for level in storage for location in level.locations
+        if location.optional
+    )
+
+
+def _fingerprint(files: Sequence[Path], locations: Sequence[Path]):
+    def identity(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    return tuple(map(identity, files)), tuple(map(os.path.exists, locations))
+
+
+_LOADED_LOCK = threading.Lock()
+# (config path, BEV__REPOSITORY) -> (files, optional locations, loaded repository)
+_LOADED = {}
@@ -1,12 +1,14 @@
 import os
 import socket
+import subprocess
 from itertools import chain
 from pathlib import Path
+from typing import List
 
 from tarn import Fanout, Level, Levels
 
 from ..exceptions import ConfigError
-from ..utils import PathOrStr
+from ..utils import PathOrStr, call_git
 from .base import StorageCluster
 from .hostname import StrHostName
 
@@ -73,3 +75,32 @@ def find_repo_root(path: PathOrStr) -> Path:
 
 def find_vcs_root(path: PathOrStr) -> Path:
     return _find_root(path, '.git')
+
+
+def find_repo_configs(vcs: PathOrStr) -> List[Path]:
+    """
+    Find all the bev configs inside the `vcs` repository.
+
+    Git already knows which files are tracked or untracked but not ignored, so the ignored data folders are never
+    traversed. If git is not available, the worktree is walked without entering `.git` and nested repositories.
+    """
+    vcs = Path(vcs)
+    try:
+        output = call_git(f'git ls-files -z --cached --others --exclude-standard -- ":(glob)**/{CONFIG}"', vcs)
+    except (OSError, subprocess.CalledProcessError):
+        return _walk_configs(vcs)
+
+    # the deleted configs are still in the index until the deletion is committed
+    return sorted({vcs / path for path in output.split('\0') if path and (vcs / path).exists()})
+
+
+def _walk_configs(vcs: Path) -> List[Path]:
+    configs = []
+    for root, folders, files in os.walk(vcs):
+        root = Path(root)
+        if CONFIG in files:
+            configs.append(root / CONFIG)
+        # the nested repositories have their own configs
+        folders[:] = [name for name in folders if name != '.git' and not (root / name / '.git').exists()]
+
+    return sorted(configs)
@@ -1,9 +1,14 @@
 import json
+import mmap
 import os
-import tempfile
-from collections import OrderedDict
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from collections.abc import ItemsView, Mapping, ValuesView
 from pathlib import Path
-from typing import Dict, NamedTuple, Union
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Tuple, Union
 
 from tarn import HashKeyStorage
 
@@ -13,6 +18,14 @@ from .utils import PathOrStr, deprecate
 Key = str
 Tree = Dict[PathOrStr, Union[Key, Dict]]
 HashType = Union[Key, Tree]
+TREE_FORMATS = 'json', 'binary'
+# binary trees: magic, version, digest size, flags, a reserved field, number of entries
+_TREE_MAGIC, _TREE_VERSION = b'BEVTREE\0', 1
+# the tree has a table that marks which entries are nested trees
+_HAS_SUBTREES = 1
+_TREE_HEADER = struct.Struct('<8sBBHIQ')
+_INDEX_TYPE = 'I'
+_INDEX_ITEM_SIZE = array(_INDEX_TYPE).itemsize
 
 
 def is_hash(path: PathOrStr):
@@ -33,6 +46,28 @@ def from_hash(path: PathOrStr):
     return path.with_name(path.stem)
 
 
+class HashIndex:
+    """ A prefix tree of all the paths that have a hash file """
+
+    def __init__(self, hashes: Iterable[PathOrStr]):
+        self._root = {}
+        for path in hashes:
+            node = self._root
+            for part in from_hash(path).parts:
+                node = node.setdefault(part, {})
+            node[None] = True
+
+    def find(self, path: PathOrStr) -> Union[Path, None]:
+        """ Get the shortest prefix of `path`, including itself, that has a hash file """
+        parts, node = Path(path).parts, self._root
+        for idx, part in enumerate(parts, 1):
+            node = node.get(part)
+            if node is None:
+                return None
+            if None in node:
+                return Path(*parts[:idx])
+
+
 def is_tree(key: Key):
     return key.startswith('T:')
 
@@ -42,9 +77,13 @@ def load_key(path: PathOrStr):
         return file.read().strip()
 
 
-def load_tree(path: Path):
-    with open(path, 'r') as file:
-        return json.load(file)
+def load_tree(path: Path) -> 'CompactTree':
+    with open(path, 'rb') as file:
+        if file.read(len(_TREE_MAGIC)) == _TREE_MAGIC:
+            return CompactTree.from_buffer(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+        file.seek(0)
+        return CompactTree(json.load(file))
 
 
 def strip_tree(key):
@@ -53,20 +92,136 @@ def strip_tree(key):
     return key
 
 
-def tree_to_hash(tree: Tree, storage: HashKeyStorage):
+def tree_to_hash(tree: Tree, storage: HashKeyStorage, tree_format: str = 'json', nested: bool = False):
+    """
+    Write the `tree` to the `storage` and return its key.
+    If `nested` - each subfolder is written as a separate tree, so that unchanged subfolders are shared between
+    versions, and the entries of the resulting tree are its immediate children.
+    """
+    if tree_format not in TREE_FORMATS:
+        raise ValueError(f'Unknown tree format: {tree_format}')
+
     tree = normalize_tree(tree, storage.digest_size)
+    if nested:
+        children, folders = {}, defaultdict(dict)
+        for path, value in tree.items():
+            name, *rest = Path(path).parts
+            if rest:
+                folders[name][os.path.join(*rest)] = value
+            else:
+                children[name] = value
+
+        for name, folder in folders.items():
+            if name in children:
+                raise ValueError(f'"{name}" is both a file and a folder')
+            children[name] = tree_to_hash(folder, storage, tree_format, nested)
+        tree = children
+
+    return _write_tree(tree, storage, tree_format)
+
+
+def update_tree(key: Key, changes: Tree, storage: HashKeyStorage, tree_format: str = 'json',
+                fetch: Optional[bool] = None, trees: Optional[Dict[Key, 'CompactTree']] = None) -> Key:
+    """
+    Add the `changes` to the nested tree with a given `key`, overwriting the colliding entries.
+    Only the subtrees that contain the changes are rewritten, the rest are reused as is.
+    `trees` is an optional memo of the already loaded subtrees.
+    """
+    tree = dict(_read_subtree(storage, key, fetch, trees).items())
+    folders = defaultdict(dict)
+    for path, value in normalize_tree(changes, storage.digest_size).items():
+        name, *rest = Path(path).parts
+        if rest:
+            folders[name][os.path.join(*rest)] = value
+        else:
+            tree[name] = value
+
+    for name, folder in folders.items():
+        previous = tree.get(name)
+        if previous is not None and is_tree(previous):
+            tree[name] = update_tree(previous, folder, storage, tree_format, fetch, trees)
+        else:
+            tree[name] = tree_to_hash(folder, storage, tree_format, nested=True)
+
+    return _write_tree(tree, storage, tree_format)
+
+
+def read_tree(storage: HashKeyStorage, key: Key, fetch: Optional[bool] = None) -> 'CompactTree':
+    """ Load a flat tree by its `key`, expanding all the nested subtrees """
+
+    def expand(tree):
+        for path, value in tree.items():
+            if is_tree(value):
+                for inner, v in read_tree(storage, value, fetch).items():
+                    yield os.path.join(path, inner), v
+            else:
+                yield path, value
+
+    tree = storage.read(load_tree, strip_tree(key), fetch=fetch)
+    if tree.has_subtrees:
+        tree = CompactTree(dict(expand(tree)))
+    return tree
+
+
+def find_subtree(tree: Mapping, relative: str) -> Union[Tuple[Key, str], None]:
+    """
+    Find the nested subtree that contains the `relative` path.
+    Returns the subtree's key and the path relative to it, or None if the path doesn't belong to a subtree.
+    """
+    if relative in tree:
+        return None
+
+    parts = Path(relative).parts
+    for idx in range(1, len(parts)):
+        value = tree.get(os.path.join(*parts[:idx]))
+        if value is not None:
+            if is_tree(value):
+                return value, os.path.join(*parts[idx:])
+            return None
+
+
+def get_from_tree(storage: HashKeyStorage, key: Key, relative: PathOrStr, fetch: Optional[bool] = None,
+                  trees: Optional[Dict[Key, 'CompactTree']] = None) -> Union[Key, None]:
+    """
+    Get the value for a `relative` path inside a possibly nested tree with a given `key`.
+    `trees` is an optional memo of the already loaded subtrees, which can be shared between calls.
+    """
+    relative = os.fspath(relative)
+    while True:
+        tree = _read_subtree(storage, key, fetch, trees)
+        subtree = find_subtree(tree, relative)
+        if subtree is None:
+            return tree.get(relative)
+        key, relative = subtree
+
+
+def _read_subtree(storage: HashKeyStorage, key: Key, fetch: Optional[bool],
+                  trees: Optional[Dict[Key, 'CompactTree']]) -> 'CompactTree':
+    key = strip_tree(key)
+    if trees is None:
+        return storage.read(load_tree, key, fetch=fetch)
+    if key not in trees:
+        trees[key] = storage.read(load_tree, key, fetch=fetch)
+    return trees[key]
+
+
+def _write_tree(tree: Dict[str, Key], storage: HashKeyStorage, tree_format: str) -> Key:
     # making sure that each time the same string will be saved
     tree = OrderedDict((k, tree[k]) for k in sorted(map(os.fspath, tree)))
-    with tempfile.TemporaryDirectory() as tmp:
-        tree_path = Path(tmp, 'hash')
-        # TODO: storage should allow writing directly from memory
-        with open(tree_path, 'w') as file:
-            json.dump(tree, file)
+    if tree_format == 'binary':
+        content = CompactTree(tree).to_bytes()
+    else:
+        # the same bytes as `json.dump` would write to a file, so the keys don't change
+        content = json.dumps(tree).encode('utf-8')
 
-        return 'T:' + storage.write(tree_path).hex()
+    return 'T:' + storage.write(content).hex()
 
 
 def normalize_tree(tree: Tree, digest_size: int):
+    # already flat and validated
+    if isinstance(tree, CompactTree) and not tree.has_subtrees and tree.digest_size in (digest_size, 0):
+        return tree
+
     def flatten(x):
         for key, value in x.items():
             key = Path(os.fspath(key))
@@ -78,7 +233,7 @@ def normalize_tree(tree: Tree, digest_size: int):
 
                 yield key, value
 
-            elif isinstance(value, dict):
+            elif isinstance(value, Mapping):
                 for k, v in flatten(value):
                     yield key / k, v
 
@@ -101,6 +256,217 @@ def normalize_tree(tree: Tree, digest_size: int):
     return result
 
 
+class CompactTree(Mapping):
+    """
+    A read-only flat tree that maps relative paths to hex digests.
+
+    The whole tree is a single buffer in the binary tree format: a header, the offsets of the sorted UTF-8 paths,
+    the paths themselves and the raw digests. This takes several times less memory than a dict and is cheap to pickle,
+    but building it from a dict is several times slower than parsing the json and needs more memory at its peak.
+    The paths are stored in full rather than as interned components, which keeps the format simple and the comparisons
+    cheap at the cost of repeating the common prefixes.
+
+    The folder queries are made using binary search, so a memory-mapped tree reads from disk only the pages it touches.
+    The point lookups use a hash index of 8-16 bytes per entry, which is built in memory on the first lookup.
+    """
+
+    def __init__(self, tree: Dict[PathOrStr, Key]):
+        items = sorted(
+            (os.fspath(path).encode('utf-8'), bytes.fromhex(strip_tree(value)), is_tree(value))
+            for path, value in tree.items()
+        )
+        sizes = {len(digest) for _, digest, _ in items}
+        if len(sizes) > 1:
+            raise ValueError(f'The digests have different sizes: {sizes}')
+
+        offsets = array('Q', [0])
+        for path, _, _ in items:
+            offsets.append(offsets[-1] + len(path))
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+
+        parts = [offsets.tobytes(), *(path for path, _, _ in items), *(digest for _, digest, _ in items)]
+        flags = 0
+        if any(subtree for _, _, subtree in items):
+            flags |= _HAS_SUBTREES
+            parts.append(bytes(subtree for _, _, subtree in items))
+
+        header = _TREE_HEADER.pack(_TREE_MAGIC, _TREE_VERSION, sizes.pop() if sizes else 0, flags, 0, len(items))
+        self._init(b''.join([header, *parts]))
+
+    @classmethod
+    def from_buffer(cls, buffer) -> 'CompactTree':
+        """ Wrap a `buffer`, e.g. bytes or mmap, that contains a tree in the binary format, without copying it """
+        tree = cls.__new__(cls)
+        tree._init(buffer)
+        return tree
+
+    @classmethod
+    def from_file(cls, path: PathOrStr) -> 'CompactTree':
+        """ Memory-map a file that contains a tree in the binary format """
+        with open(path, 'rb') as file:
+            return cls.from_buffer(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def to_bytes(self) -> bytes:
+        """ Get the binary representation of the tree """
+        return self._buffer[:]
+
+    @property
+    def is_mapped(self) -> bool:
+        """ Whether the tree is backed by a memory-mapped file """
+        return isinstance(self._buffer, mmap.mmap)
+
+    @property
+    def has_subtrees(self) -> bool:
+        """ Whether some of the entries are nested trees """
+        return bool(self._flags & _HAS_SUBTREES)
+
+    def is_folder(self, path: PathOrStr) -> bool:
+        """ Whether the `path` is a folder inside the tree """
+        prefix = os.fspath(path).encode('utf-8') + b'/'
+        idx = bisect_left(_SortedPaths(self), prefix)
+        return idx < len(self) and self._path(idx).startswith(prefix)
+
+    def iter_folder(self, folder: PathOrStr = '.') -> Iterator[Tuple[str, Key]]:
+        """ The entries inside the `folder`, at any depth, in sorted order """
+        folder = os.fspath(folder)
+        prefix = b'' if folder in ('', '.') else folder.encode('utf-8') + b'/'
+        idx = bisect_left(_SortedPaths(self), prefix)
+        while idx < len(self):
+            path = self._path(idx)
+            if not path.startswith(prefix):
+                break
+            yield path.decode('utf-8'), self._value(idx)
+            idx += 1
+
+    def digest(self, path: PathOrStr) -> bytes:
+        """ The raw digest for a given `path`. For nested trees it's the digest of the tree """
+        return self._digest(self._find(path))
+
+    def items(self):
+        return _Items(self)
+
+    def values(self):
+        return _Values(self)
+
+    def __getitem__(self, path: PathOrStr) -> Key:
+        return self._value(self._find(path))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self._path(idx).decode('utf-8')
+
+    def __len__(self):
+        return self._count
+
+    def __sizeof__(self):
+        # the index is accounted for in advance, so that the caches don't have to track it
+        return super().__sizeof__() + len(self._buffer) + _index_size(self._count) * _INDEX_ITEM_SIZE
+
+    def __reduce__(self):
+        return type(self).from_buffer, (self.to_bytes(),)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({len(self)} entries)'
+
+    def _init(self, buffer):
+        if len(buffer) < _TREE_HEADER.size:
+            raise ValueError('The buffer is too small')
+        magic, version, digest_size, flags, _, count = _TREE_HEADER.unpack_from(buffer)
+        if magic != _TREE_MAGIC:
+            raise ValueError('The buffer does not contain a binary tree')
+        if version != _TREE_VERSION:
+            raise ValueError(f'Unsupported binary tree version: {version}')
+
+        start, stop = _TREE_HEADER.size, _TREE_HEADER.size + 8 * (count + 1)
+        if sys.byteorder == 'little':
+            offsets = memoryview(buffer)[start:stop].cast('Q')
+        else:
+            offsets = array('Q', buffer[start:stop])
+            offsets.byteswap()
+
+        self._buffer, self._offsets, self._count, self.digest_size = buffer, offsets, count, digest_size
+        self._flags, self._paths_start, self._digests_start = flags, stop, stop + offsets[count]
+        self._subtrees_start = self._digests_start + count * digest_size
+        self._index = None
+        size = self._subtrees_start + (count if flags & _HAS_SUBTREES else 0)
+        if len(buffer) != size:
+            raise ValueError('The binary tree is truncated')
+
+    def _find(self, path: PathOrStr) -> int:
+        try:
+            encoded = os.fspath(path).encode('utf-8')
+        except (TypeError, UnicodeError):
+            raise KeyError(path) from None
+
+        index = self._index
+        if index is None:
+            index = self._index = self._build_index()
+
+        mask = len(index) - 1
+        slot = hash(encoded) & mask
+        while index[slot]:
+            idx = index[slot] - 1
+            if self._path(idx) == encoded:
+                return idx
+            slot = (slot + 1) & mask
+        raise KeyError(path)
+
+    def _build_index(self) -> array:
+        # open addressing with linear probing, the slots contain idx + 1, so that 0 marks an empty slot
+        index = array(_INDEX_TYPE, [0]) * _index_size(self._count)
+        mask = len(index) - 1
+        for idx in range(self._count):
+            slot = hash(self._path(idx)) & mask
+            while index[slot]:
+                slot = (slot + 1) & mask
+            index[slot] = idx + 1
+        return index
+
+    def _path(self, idx: int) -> bytes:
+        return self._buffer[self._paths_start + self._offsets[idx]:self._paths_start + self._offsets[idx + 1]]
+
+    def _digest(self, idx: int) -> bytes:
+        start = self._digests_start + idx * self.digest_size
+        return self._buffer[start:start + self.digest_size]
+
+    def _value(self, idx: int) -> Key:
+        value = self._digest(idx).hex()
+        if self._flags & _HAS_SUBTREES and self._buffer[self._subtrees_start + idx]:
+            value = 'T:' + value
+        return value
+
+
+def _index_size(count: int) -> int:
+    # a power of 2 with at least half of the slots empty
+    return 1 << (2 * count).bit_length()
+
+
+class _SortedPaths:
+    def __init__(self, tree: CompactTree):
+        self._tree = tree
+
+    def __getitem__(self, idx):
+        return self._tree._path(idx)
+
+    def __len__(self):
+        return len(self._tree)
+
+
+class _Items(ItemsView):
+    def __iter__(self):
+        tree = self._mapping
+        for idx, path in enumerate(tree):
+            yield path, tree._value(idx)
+
+
+class _Values(ValuesView):
+    def __iter__(self):
+        tree = self._mapping
+        for idx in range(len(tree)):
+            yield tree._value(idx)
+
+
 @deprecate
 def dispatch_hash(path):  # pragma: no cover
     path = Path(path)
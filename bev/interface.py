@@ -1,19 +1,48 @@
+import copy
 import inspect
 import os
-from functools import lru_cache
+from collections import defaultdict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from itertools import takewhile
 from pathlib import Path
-from typing import Optional, Sequence, Union
-
-from tarn.digest import digest_value
-from wcmatch.glob import GLOBSTAR
-
-from .config import CONFIG, build_storage, find_vcs_root
-from .exceptions import HashNotFound, InconsistentHash, InconsistentRepositories, NameConflict, RepositoryNotFound
-from .hash import Key, is_hash, is_tree, load_key, load_tree, strip_tree, to_hash
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from tarn.exceptions import StorageError
+from wcmatch.glob import DOTGLOB, GLOBSTAR, escape, is_magic
+
+from .aio import IO, InFlight, arun_io, run_blocking, run_io
+from .cache import CacheInfo, LRUCache, TreeImages, tree_footprint, user_cache_dir
+from .config import find_repo_configs, find_vcs_root, load_repository
+from .exceptions import (
+    BevError,
+    ConfigError,
+    HashNotFound,
+    InconsistentHash,
+    InconsistentRepositories,
+    NameConflict,
+    RepositoryNotFound,
+)
+from .hash import (
+    CompactTree,
+    HashIndex,
+    Key,
+    find_subtree,
+    is_hash,
+    is_tree,
+    load_key,
+    load_tree,
+    read_tree,
+    strip_tree,
+    to_hash,
+)
 from .local import Local
+from .parallel import Fetcher
 from .utils import PathOrStr
 from .vc import VC, CommittedVersion, SubprocessGit, Version
-from .wc import BevLocalGlob, BevVCGlob
+from .verify import Verifier
+from .wc import BevGlob, BevLocalGlob, BevVCGlob, glob_tree
+
+_missing = object()
 
 
 class Repository:
@@ -34,19 +63,61 @@ class Repository:
     check: bool
         default value for `resolve` mode. If True - the file's hash will be additionally checked for consistency.
         Can be overridden in corresponding methods
+    vc:
+        the version control backend: a callable that takes the repository's root and returns a `VC` object,
+        e.g. `SubprocessGit`, `CatFileGit` or `NativeGit`
+    tree_cache_size: int, None
+        the approximate memory budget, in bytes, for the parsed trees. None - means no limit
+    max_workers: int, None
+        the number of threads used to fetch files from remote locations. None - means that all the files are
+        fetched sequentially in the calling thread
+    executor: Executor, None
+        the executor used to fetch files from remote locations and to verify their hashes in background.
+        Overrides `max_workers`
+    disk_cache: bool
+        whether to keep the binary images of the parsed trees and the digests of the verified files in the user's
+        cache folder (`$XDG_CACHE_HOME/bev` or `~/.cache/bev`), so that the processes on the same node share them.
+        Each cache takes at most `disk_cache_size` bytes and can be safely removed at any moment.
+        The repositories restored from pickle, e.g. in worker processes, always use it
     """
 
-    def __init__(self, *root: PathOrStr, fetch: bool = True, version: Optional[Version] = None, check: bool = False):
+    # the maximal number of folders, whose normalized trees are cached during glob
+    glob_cache_size: int = 1024
+    # the maximal number of versions, for which the locations of hash files are cached
+    hash_index_cache_size: int = 16
+    # the maximal total size in bytes of the normalized trees, which are reused between glob calls
+    glob_tree_cache_size: int = 2 ** 28
+    # the maximal size in bytes of each of the caches in the user's cache folder
+    disk_cache_size: int = 2 ** 30
+
+    def __init__(self, *root: PathOrStr, fetch: bool = True, version: Optional[Version] = None, check: bool = False,
+                 vc: Callable[[Path], VC] = SubprocessGit, tree_cache_size: Optional[int] = 2 ** 30,
+                 max_workers: Optional[int] = None, executor: Optional[Executor] = None, disk_cache: bool = False):
         self.root = Path(*root)
         self.prefix = Path()
-        self.storage, self.cache = build_storage(self.root)
-        self.vc: VC = SubprocessGit(self.root)
+        config, self.storage, self.cache, self._fingerprint = load_repository(self.root)
+        self.tree_format = config.meta.tree_format or 'json'
+        self.nested_trees = bool(config.meta.nested_trees)
+        self.vc: VC = vc(self.root)
+        self._vc_factory = vc
         self.fetch, self.version, self.check = fetch, version, check
-        self._cache = {}
+        self._cache = LRUCache(self.glob_cache_size)
+        self._glob_trees = LRUCache(self.glob_tree_cache_size, tree_footprint)
+        self._trees = LRUCache(tree_cache_size, tree_footprint)
+        self._hash_indices = LRUCache(self.hash_index_cache_size)
+        self._in_flight = InFlight()
+        if executor is None and max_workers is not None:
+            executor = ThreadPoolExecutor(max_workers)
+        self._fetcher = Fetcher(executor)
+        self._verifier = Verifier(
+            self.storage.algorithm, user_cache_dir() / 'digests' if disk_cache else None, executor,
+            disk_cache_size=self.disk_cache_size,
+        )
+        self._read_tree = TreeImages(user_cache_dir() / 'trees', self.disk_cache_size).load if disk_cache else load_tree
 
     @classmethod
     def from_here(cls, *relative: PathOrStr, fetch: bool = True, version: Optional[Version] = None,
-                  check: Optional[bool] = None) -> 'Repository':
+                  check: Optional[bool] = None, vc: Callable[[Path], VC] = SubprocessGit) -> 'Repository':
         """
         Creates a repository with a path `relative` to the file in which this method is called.
 
@@ -55,7 +126,7 @@ class Repository:
         >>> repo = Repository.from_here('../../data')
         """
         file = Path(inspect.stack()[1].filename)
-        return cls(file.parent / Path(*relative), fetch=fetch, version=version, check=check)
+        return cls(file.parent / Path(*relative), fetch=fetch, version=version, check=check, vc=vc)
 
     @classmethod
     def from_vcs(cls, *parts: PathOrStr) -> 'Repository':
@@ -63,7 +134,7 @@ class Repository:
         if vcs is None:
             raise RepositoryNotFound(f'{Path(*parts)} is not inside a vcs repository')
 
-        configs = list(vcs.rglob(CONFIG))
+        configs = find_repo_configs(vcs)
         if not configs:
             raise RepositoryNotFound(f'{Path(*parts)} is not inside a bev repository')
         if len(configs) > 1:
@@ -75,18 +146,34 @@ class Repository:
         """
         Get the last commit given the relative `path`.
         """
-        path = self._resolve_relative(path)
-        if not (self.root / path).exists() and not is_hash(path):
-            path = to_hash(path)
+        return self.latest_versions([path], default=default)[0]
 
-        version = self.vc.get_version(str(path))
-        if version is None:
-            if default is inspect.Parameter.empty:
-                raise FileNotFoundError(f'The path "{path}" is not present in any commit')
+    def latest_versions(self, paths: Sequence[PathOrStr], *,
+                        default=inspect.Parameter.empty) -> Sequence[CommittedVersion]:
+        """
+        Get the last commit for each of the relative `paths`.
+        All the paths are processed in a single pass over the history, and the results are memoized on disk.
+        """
+        relatives = []
+        for path in paths:
+            path = self._resolve_relative(path)
+            if not (self.root / path).exists() and not is_hash(path):
+                path = to_hash(path)
+            relatives.append(str(path))
 
-            return default
+        found = self.vc.get_versions(relatives)
+        result = []
+        for path in relatives:
+            version = found[os.path.normpath(path)]
+            if version is None:
+                if default is inspect.Parameter.empty:
+                    raise FileNotFoundError(f'The path "{path}" is not present in any commit')
 
-        return version
+                version = default
+
+            result.append(version)
+
+        return result
 
     def resolve(self, *parts: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None,
                 check: Optional[bool] = None) -> Path:
@@ -108,12 +195,7 @@ class Repository:
 
         def _resolve(path):
             if check:
-                digest = digest_value(path, self.storage.algorithm).hex()
-                if digest != key:
-                    raise InconsistentHash(
-                        f'The path "{Path(*parts)}" has a wrong hash: expected "{key}", actual "{digest}"'
-                    )
-
+                self._verify(Path(*parts), key, path)
             return path
 
         relative = self._resolve_relative(*parts)
@@ -128,7 +210,121 @@ class Repository:
             return absolute.resolve()
 
         key = self.get_key(relative, version=version, fetch=fetch)
-        return self.storage.read(_resolve, key, fetch=fetch)
+        return self._load(_resolve, key, fetch)
+
+    async def aresolve(self, *parts: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None,
+                       check: Optional[bool] = None) -> Path:
+        """
+        Same as `resolve`, but doesn't block the event loop.
+        Concurrent calls for the same key share all the git and storage requests.
+        """
+        version = await self._aresolve_version(version)
+        fetch = self._resolve_fetch(fetch)
+        check = self._resolve_check(check)
+        if version == Local:
+            return await run_blocking(self.resolve, *parts, version=version, fetch=fetch, check=check)
+
+        key = await self.aget_key(*parts, version=version, fetch=fetch)
+        path = await self._in_flight.run(
+            ('path', key, fetch), lambda: run_blocking(self._load, Path, key, fetch)
+        )
+        if check:
+            digest = await self._in_flight.run(('digest', path), lambda: run_blocking(self._verifier.digest, path))
+            self._check_digest(Path(*parts), key, digest)
+
+        return path
+
+    def resolve_many(self, paths: Sequence[PathOrStr], version: Optional[Version] = None,
+                     fetch: Optional[bool] = None, check: Optional[bool] = None) -> List[Union[Path, Exception]]:
+        """
+        Same as `resolve`, but for a batch of `paths`.
+        Each tree is loaded only once, and all the missing files are fetched in a single batch.
+
+        Returns the real paths in the same order as `paths`. If a path can't be resolved, the corresponding
+        exception is returned in its place instead.
+        """
+        if self._resolve_check(check):
+            return self._resolve_many(paths, version, fetch, self._verify)
+        return self._resolve_many(paths, version, fetch, lambda name, key, path: path)
+
+    def verify(self, paths: Sequence[PathOrStr], version: Optional[Version] = None,
+               fetch: Optional[bool] = None) -> List[Future]:
+        """
+        Same as `resolve_many` with `check=True`, but the hashes are checked in background by a pool of workers.
+        The files that didn't change since their last verification are not hashed again.
+
+        Returns a future for each path, which contains either its real path or the corresponding exception.
+        """
+
+        def done(value):
+            future = Future()
+            if isinstance(value, Exception):
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+            return future
+
+        return [
+            value if isinstance(value, Future) else done(value)
+            for value in self._resolve_many(
+                paths, version, fetch, lambda *args: self._verifier.executor.submit(self._verify, *args)
+            )
+        ]
+
+    def _resolve_many(self, paths, version, fetch, finalize):
+        version = self._resolve_version(version)
+        fetch = self._resolve_fetch(fetch)
+
+        # group the paths by the hash files they belong to
+        result, groups = [None] * len(paths), defaultdict(list)
+        for idx, path in enumerate(paths):
+            relative = self._resolve_relative(path)
+            try:
+                absolute = self.root / relative
+                if version == Local and absolute.exists():
+                    if to_hash(absolute).exists():
+                        raise NameConflict(f'Both the path "{relative}" and its hash "{to_hash(relative)}" found')
+                    result[idx] = absolute.resolve()
+                    continue
+
+                h = self._split(relative, version)
+                if isinstance(h, Key):
+                    result[idx] = h
+                else:
+                    tree, inner = h
+                    if inner == '.':
+                        raise HashNotFound(f'"{relative}" is a hashed folder')
+                    groups[tree].append((idx, relative, inner))
+
+            except (BevError, StorageError) as e:
+                result[idx] = e
+
+        self._fetch_missing(groups, fetch)
+        for tree, entries in groups.items():
+            try:
+                tree = self._get_tree(tree, fetch=False)
+            except StorageError as e:
+                tree = e
+
+            for idx, relative, inner in entries:
+                try:
+                    if isinstance(tree, Exception):
+                        raise tree
+                    result[idx] = run_io(self._find_in_tree_steps(relative, tree, inner, fetch, error=True))
+                except (BevError, StorageError) as e:
+                    result[idx] = e
+
+        # at this point the result contains either keys, local paths or errors
+        indices = [idx for idx, value in enumerate(result) if isinstance(value, Key)]
+        self._fetch_missing({result[idx] for idx in indices}, fetch)
+        for idx in indices:
+            key = result[idx]
+            try:
+                result[idx] = finalize(Path(paths[idx]), key, self.storage.read(Path, key, fetch=False))
+            except (BevError, StorageError) as e:
+                result[idx] = e
+
+        return result
 
     def glob(self, *parts: PathOrStr, version: Optional[Version] = None,
              fetch: Optional[bool] = None) -> Sequence[Path]:
@@ -145,58 +341,120 @@ class Repository:
             the data version. Can be either a string with a commit hash/tag or the `Local` object, which
             means that the local (possibly uncommitted) version of the files will be used
         """
-        version = self._resolve_version(version)
-        fetch = self._resolve_fetch(fetch)
-        pattern = os.path.join(*parts)
+        return list(self.iglob(*parts, version=version, fetch=fetch))
 
+    def iglob(self, *parts: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None,
+              keys: bool = False) -> Iterator[Union[Path, Tuple[Path, Optional[Key]]]]:
+        """
+        Same as `glob`, but the paths are yielded lazily, as soon as they are found.
+        If `keys` - pairs (path, key) are yielded instead, where the key is None for folders and non-hashed files.
+        """
+        return self._iglob(os.path.join(*parts), version, fetch, GLOBSTAR, keys)
+
+    def iterdir(self, *parts: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None,
+                keys: bool = False) -> Iterator[Union[Path, Tuple[Path, Optional[Key]]]]:
+        """
+        Lazily iterate over the contents of a folder, including the hidden entries.
+        If `keys` - pairs (path, key) are yielded instead, same as in `iglob`.
+        """
+        pattern = os.path.join(escape(os.path.join(*parts)) if parts else '', '*')
+        return self._iglob(pattern, version, fetch, DOTGLOB, keys)
+
+    def walk(self, *parts: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None,
+             keys: bool = False) -> Iterator[Tuple[Path, List[str], Union[List[str], Dict[str, Optional[Key]]]]]:
+        """
+        Same as `os.walk`, but for the repository: lazily yields (folder, folder names, file names) top-down.
+        As with `os.walk`, the folder names can be modified in-place to prune the traversal.
+        If `keys` - the file names are replaced by a dict that maps the names to the keys.
+        """
+        glob = self._make_glob('*', version, fetch, DOTGLOB)
+        stack = [Path(*parts)]
+        while stack:
+            folder = stack.pop()
+            folders, files = [], {}
+            for entry in glob.scandir(folder):
+                if entry.is_dir:
+                    folders.append(entry.name)
+                else:
+                    files[entry.name] = glob.get_key(folder / entry.name) if keys else None
+
+            yield folder, folders, files if keys else list(files)
+            stack.extend(folder / name for name in reversed(folders))
+
+    async def aglob(self, *parts: PathOrStr, version: Optional[Version] = None,
+                    fetch: Optional[bool] = None) -> Sequence[Path]:
+        """ Same as `glob`, but doesn't block the event loop """
+        version = await self._aresolve_version(version)
+        fetch = self._resolve_fetch(fetch)
         if version == Local:
-            glob = BevLocalGlob(pattern, self.root, self.prefix, self.storage, fetch, GLOBSTAR)
-        else:
-            glob = BevVCGlob(
-                pattern, self.root, self.prefix, version, self._cache, self.vc, self.storage, fetch, GLOBSTAR
-            )
+            return await run_blocking(self.glob, *parts, version=version, fetch=fetch)
 
-        return list(map(Path, glob.glob()))
+        return await self._in_flight.run(
+            ('glob', self.prefix, os.path.join(*parts), version, fetch),
+            lambda: run_blocking(self.glob, *parts, version=version, fetch=fetch)
+        )
 
-    # TODO: cache this based on path parents
     def get_key(self, *parts: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None,
                 error: bool = True) -> Union[Key, None]:
         version = self._resolve_version(version)
-        path = self._resolve_relative(*parts)
-        try:
-            h = self._split(path, version)
-        except HashNotFound:
-            if error:
-                raise
-            return None
+        return run_io(self._get_key_steps(self._resolve_relative(*parts), version, fetch, error))
 
-        if isinstance(h, Key):
-            return h
+    async def aget_key(self, *parts: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None,
+                       error: bool = True) -> Union[Key, None]:
+        """ Same as `get_key`, but doesn't block the event loop """
+        version = await self._aresolve_version(version)
+        return await arun_io(self._get_key_steps(self._resolve_relative(*parts), version, fetch, error))
 
-        h, relative = h
-        if relative == '.':
-            raise HashNotFound(f'"{path}" is a hashed folder')
-
-        tree = self._get_tree(h, version, fetch)
-        if relative not in tree:
-            if relative in self._expand_folders(tree):
-                raise HashNotFound(f'"{path}" is a folder inside a tree hash')
-
-            if error:
-                raise HashNotFound(str(path))
-            return None
-
-        return tree[relative]
-
-    def load_tree(self, path: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None) -> dict:
-        path = self._resolve_relative(path)
+    def load_tree(self, path: PathOrStr, version: Optional[Version] = None,
+                  fetch: Optional[bool] = None) -> CompactTree:
         version = self._resolve_version(version)
-        key = self._get_hash(Path(path), version)
-        if key is None:
-            raise HashNotFound(path)
-
-        key = strip_tree(key)
-        return self._get_tree(key, version, fetch)
+        return run_io(self._load_tree_steps(self._resolve_relative(path), version, fetch))
+
+    async def aload_tree(self, path: PathOrStr, version: Optional[Version] = None,
+                         fetch: Optional[bool] = None) -> CompactTree:
+        """ Same as `load_tree`, but doesn't block the event loop """
+        version = await self._aresolve_version(version)
+        return await arun_io(self._load_tree_steps(self._resolve_relative(path), version, fetch))
+
+    def clear_caches(self):
+        """ Drop all the in-memory caches, including the ones of the version control """
+        self._cache.clear()
+        self._glob_trees.clear()
+        self._trees.clear()
+        self._hash_indices.clear()
+        self.vc.clear_caches()
+
+    def cache_info(self) -> Dict[str, CacheInfo]:
+        """ Hits, misses, size and weight of the in-memory caches """
+        return {
+            'trees': self._trees.info(), 'hashes': self._hash_indices.info(), 'glob': self._cache.info(),
+            'glob_trees': self._glob_trees.info(),
+        }
+
+    def handle(self) -> 'RepositoryHandle':
+        """
+        A lightweight picklable description of the repository, e.g. for worker processes.
+        The default version is pinned to a commit, so that all the workers see the same data.
+        """
+        version, local = self.version, self.version == Local
+        if local:
+            # `Local` can't be pickled
+            version = None
+        elif version is not None:
+            version = self._resolve_version(version)
+        return RepositoryHandle(
+            self.root, self.prefix, self.fetch, version, self.check, self._vc_factory, self._trees.max_weight,
+            self._fingerprint, local,
+        )
+
+    def __reduce__(self):
+        return RepositoryHandle.open, (self.handle(),)
+
+    def __copy__(self):
+        # unlike pickling, a copy shares the storage, vc and caches
+        copied = object.__new__(type(self))
+        copied.__dict__.update(self.__dict__)
+        return copied
 
     # navigation
 
@@ -205,10 +463,9 @@ class Repository:
         if other.is_absolute():
             raise ValueError('Only relative paths are supported')
 
-        child = Repository(self.root, fetch=self.fetch, version=self.version, check=self.check)
-        # FIXME
+        # the config, storage, vc and caches don't depend on the prefix, so they are simply shared
+        child = copy.copy(self)
         child.prefix = self.prefix / other
-        child._cache = self._cache
         return child
 
     @property
@@ -217,15 +474,75 @@ class Repository:
 
     # internal logic
 
-    def _get_tree(self, key, version, fetch):
-        # we need the version here, because we want to cache only a committed tree
-        if version == Local:
-            return self._load(load_tree, key, fetch)
-        return self._load_cached_tree(key, fetch)
+    # the generators below are shared by the sync and async methods, see `run_io` for details
 
-    @lru_cache(None)
-    def _load_cached_tree(self, key, fetch):
-        return self._load(load_tree, key, fetch=fetch)
+    def _get_key_steps(self, path: Path, version: Version, fetch: Optional[bool], error: bool):
+        try:
+            h = yield from self._split_steps(path, version)
+        except HashNotFound:
+            if error:
+                raise
+            return None
+
+        if isinstance(h, Key):
+            return h
+
+        h, relative = h
+        if relative == '.':
+            raise HashNotFound(f'"{path}" is a hashed folder')
+
+        tree = yield IO(self._get_tree, self._aget_tree, (h, fetch))
+        return (yield from self._find_in_tree_steps(path, tree, relative, fetch, error))
+
+    def _load_tree_steps(self, path: PathOrStr, version: Version, fetch: Optional[bool]):
+        key = yield IO(self._get_hash, self._aget_hash, (Path(path), version))
+        if key is None:
+            raise HashNotFound(path)
+
+        key = strip_tree(key)
+        tree = yield IO(self._get_tree, self._aget_tree, (key, fetch))
+        if tree.has_subtrees:
+            tree = yield IO.blocking(read_tree, self.storage, key, self._resolve_fetch(fetch))
+        return tree
+
+    def _split_steps(self, path: Path, version: Version):
+        if version == Local:
+            owner, key = yield IO.blocking(self._find_local_hash, path)
+        else:
+            # a single lookup instead of probing each parent
+            owner = (yield IO(self._get_hash_index, self._aget_hash_index, (version,))).find(path)
+            key = None if owner is None else (yield IO(self._get_hash, self._aget_hash, (to_hash(owner), version)))
+
+        return self._split_key(path, owner, key)
+
+    def _find_in_tree_steps(self, path: Path, tree: CompactTree, relative: str, fetch: Optional[bool], error: bool):
+        # descend into the nested subtrees, if any
+        subtree = find_subtree(tree, relative) if tree.has_subtrees else None
+        while subtree is not None:
+            key, relative = subtree
+            tree = yield IO(self._get_tree, self._aget_tree, (strip_tree(key), fetch))
+            subtree = find_subtree(tree, relative) if tree.has_subtrees else None
+
+        return self._get_from_tree(path, tree, relative, error)
+
+    def _get_tree(self, key, fetch):
+        # the keys are content hashes, so a parsed tree never goes stale, even for the local version.
+        # the tree is also the same regardless of `fetch`, so it's not a part of the key
+        tree = self._trees.get(key)
+        if tree is None:
+            tree = self._load(self._read_tree, key, fetch=fetch)
+            self._trees.set(key, tree)
+        return tree
+
+    async def _aget_tree(self, key, fetch):
+        tree = self._trees.get(key)
+        if tree is None:
+            fetch = self._resolve_fetch(fetch)
+            tree = await self._in_flight.run(
+                ('tree', key, fetch), lambda: run_blocking(self._load, self._read_tree, key, fetch)
+            )
+            self._trees.set(key, tree)
+        return tree
 
     def _get_hash(self, relative: PathOrStr, version: Version):
         if version == Local:
@@ -238,29 +555,160 @@ class Repository:
             assert isinstance(version, CommittedVersion), type(version)
             return self.vc.read(str(relative), version)
 
+    async def _aget_hash(self, relative: PathOrStr, version: Version):
+        if version == Local:
+            return await run_blocking(self._get_hash, relative, version)
+        return await self.vc.aread(str(relative), version)
+
+    def _fetch_missing(self, keys: Iterable[Key], fetch: bool):
+        """ Fetch all the `keys` that are not present locally in a single batch """
+        if fetch:
+            missing = [
+                bytes.fromhex(key) for key in keys
+                if not self.storage.read(lambda x: x is not None, key, fetch=False, error=False)
+            ]
+            if missing:
+                # the failures are reported later, when the keys are read
+                self._fetcher.fetch(self.storage, missing)
+
+    def _verify(self, path: Path, key: Key, real: Path) -> Path:
+        self._check_digest(path, key, self._verifier.digest(real))
+        return real
+
+    @staticmethod
+    def _check_digest(path: Path, key: Key, digest: str):
+        if digest != key:
+            raise InconsistentHash(f'The path "{path}" has a wrong hash: expected "{key}", actual "{digest}"')
+
     def _load(self, func, key, fetch):
-        fetch = self._resolve_fetch(fetch)
-        return self.storage.read(func, key, fetch=fetch)
+        # most of the keys are already present locally, so they are read right away
+        value = self.storage.read(lambda path: _missing if path is None else func(path), key, fetch=False, error=False)
+        if value is not _missing:
+            return value
+
+        # the fetcher makes sure that concurrent requests for the same key don't download it twice
+        if self._resolve_fetch(fetch):
+            self._fetcher.fetch(self.storage, [bytes.fromhex(key)])
+        return self.storage.read(func, key, fetch=False)
 
     def _split(self, path: Path, version: Version):
-        # TODO: use bin-search?
-        for parent in list(reversed(path.parents))[1:]:
-            hash_path = to_hash(parent)
-            key = self._get_hash(hash_path, version)
+        return run_io(self._split_steps(path, version))
+
+    def _find_local_hash(self, path: Path):
+        for parent in [*list(reversed(path.parents))[1:], path]:
+            key = self._get_hash(to_hash(parent), Local)
             if key is not None:
-                key = strip_tree(key)
-                return key, str(path.relative_to(parent))
+                return parent, key
 
-        hash_path = to_hash(path)
-        key = self._get_hash(hash_path, version)
+        return None, None
+
+    @staticmethod
+    def _split_key(path: Path, owner: Optional[Path], key: Optional[Key]):
         if key is None:
             raise HashNotFound(path)
-
+        if owner != path:
+            return strip_tree(key), str(path.relative_to(owner))
         if is_tree(key):
             return key, '.'
-
         return key
 
+    def _get_hash_index(self, version: CommittedVersion) -> HashIndex:
+        index = self._hash_indices.get(version)
+        if index is None:
+            index = HashIndex(self.vc.find_hashes(version))
+            self._hash_indices.set(version, index)
+        return index
+
+    async def _aget_hash_index(self, version: CommittedVersion) -> HashIndex:
+        index = self._hash_indices.get(version)
+        if index is None:
+            index = HashIndex(await self._in_flight.run(('hashes', version), lambda: self.vc.afind_hashes(version)))
+            self._hash_indices.set(version, index)
+        return index
+
+    def _iglob(self, pattern: str, version: Optional[Version], fetch: Optional[bool], flags: int, keys: bool):
+        version = self._resolve_version(version)
+        fetch = self._resolve_fetch(fetch)
+        matches = self._glob_tree(pattern, version, fetch, flags)
+        if matches is not None:
+            for path, key in matches:
+                yield (path, key) if keys else path
+            return
+
+        glob = self._make_glob(pattern, version, fetch, flags)
+        for match in glob.glob():
+            yield self._with_key(glob, Path(match), keys)
+
+    def _glob_tree(self, pattern: str, version: Version, fetch: bool, flags: int):
+        """ If the pattern's literal prefix lies inside a hashed folder, match it directly against the flat tree """
+        parts = [*self.prefix.parts, *pattern.split('/')]
+        if '.' in parts or '..' in parts:
+            return None
+        literal = list(takewhile(lambda part: part and not is_magic(part, flags=flags), parts[:-1]))
+        if not literal:
+            return None
+
+        relative = Path(*literal)
+        if version == Local and (self.root / relative).exists():
+            return None
+        try:
+            h = self._split(relative, version)
+        except HashNotFound:
+            return None
+        if isinstance(h, Key):
+            return None
+
+        key, inner = strip_tree(h[0]), h[1]
+        # the pattern is matched relative to the parent of the hashed folder, so that the folder itself can match
+        depth = len(relative.parts) - (0 if inner == '.' else len(Path(inner).parts)) - 1
+        parent = Path(*relative.parts[:depth])
+        tree = self._get_tree(key, fetch)
+        if tree.has_subtrees:
+            tree = read_tree(self.storage, key, fetch)
+
+        matches = (
+            ((parent / path).relative_to(self.prefix), key)
+            for path, key in glob_tree(tree, '/'.join(parts[depth:]), flags, relative.parts[depth])
+        )
+        # same as in wcmatch, the starting folder itself is never matched
+        return ((path, key) for path, key in matches if path.parts)
+
+    def _make_glob(self, pattern: str, version: Optional[Version], fetch: Optional[bool], flags: int) -> BevGlob:
+        version = self._resolve_version(version)
+        fetch = self._resolve_fetch(fetch)
+
+        def prefetch(keys):
+            self._fetch_missing(keys, fetch)
+
+        if version == Local:
+            return BevLocalGlob(pattern, self.root, self.prefix, self.storage, fetch, flags, prefetch, self._glob_trees)
+        return BevVCGlob(
+            pattern, self.root, self.prefix, version, self._cache, self.vc, self.storage, fetch, flags, prefetch,
+            self._glob_trees,
+        )
+
+    @staticmethod
+    def _with_key(glob: BevGlob, path: Path, keys: bool):
+        if not keys:
+            return path
+        # the glob has already read the keys of all the entries it has seen
+        return path, glob.get_key(path)
+
+    @staticmethod
+    def _get_from_tree(path: Path, tree: CompactTree, relative: str, error: bool) -> Union[Key, None]:
+        if relative not in tree:
+            if tree.is_folder(relative):
+                raise HashNotFound(f'"{path}" is a folder inside a tree hash')
+
+            if error:
+                raise HashNotFound(str(path))
+            return None
+
+        value = tree[relative]
+        if is_tree(value):
+            raise HashNotFound(f'"{path}" is a folder inside a tree hash')
+        return value
+
     def _resolve_check(self, check):
         if check is None:
             return self.check
@@ -272,6 +720,19 @@ class Repository:
         return fetch
 
     def _resolve_version(self, version) -> Version:
+        version = self._default_version(version)
+        if version != Local:
+            # all the caches are keyed by the commit hash, so that aliases, e.g. a branch and a tag, share them
+            version = self.vc.resolve_version(version)
+        return version
+
+    async def _aresolve_version(self, version) -> Version:
+        version = self._default_version(version)
+        if version != Local:
+            version = await self.vc.aresolve_version(version)
+        return version
+
+    def _default_version(self, version) -> Version:
         if version is None:
             version = self.version
         if version is None:
@@ -283,9 +744,26 @@ class Repository:
             return self.prefix
         return self.prefix / Path(*parts)
 
-    @staticmethod
-    def _expand_folders(tree) -> set:
-        result = set(tree)
-        for file in tree:
-            result.update(map(str, list(Path(file).parents)[:-1]))
-        return result
+
+class RepositoryHandle(NamedTuple):
+    """ Everything needed to recreate a `Repository` in another process """
+    root: Path
+    prefix: Path
+    fetch: bool
+    version: Optional[Version]
+    check: bool
+    vc: Callable[[Path], VC]
+    tree_cache_size: Optional[int]
+    fingerprint: tuple
+    # whether the version is `Local`
+    local: bool = False
+
+    def open(self) -> Repository:
+        """ Recreate the repository. The config is loaded only once per process """
+        repo = Repository(
+            self.root, fetch=self.fetch, version=Local if self.local else self.version, check=self.check, vc=self.vc,
+            tree_cache_size=self.tree_cache_size, disk_cache=True,
+        )
+        if repo._fingerprint != self.fingerprint:
+            raise ConfigError(f'The config of the repository {self.root} has changed')
+        return repo / self.prefix
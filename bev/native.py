@@ -0,0 +1,576 @@
+import heapq
+import mmap
+import os
+import re
+import zlib
+from bisect import bisect_left
+from contextlib import suppress
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Tuple, Union
+
+from .cache import LRUCache
+from .config import find_vcs_root
+from .vc import VC, CommittedVersion, TreeEntry, find_git_dirs, is_commit_hash
+
+Oid = bytes
+
+_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+_OFS_DELTA, _REF_DELTA = 6, 7
+_REV_SUFFIX = re.compile(r'(\^\{\w*\}|[~^]\d*)$')
+
+
+class Commit(NamedTuple):
+    tree: Oid
+    parents: Tuple[Oid, ...]
+    time: int
+
+
+class GitEntry(NamedTuple):
+    name: str
+    mode: str
+    oid: Oid
+
+    @property
+    def is_dir(self):
+        return self.mode == '40000'
+
+
+class NativeGit(VC):
+    """
+    A `VC` that reads the refs, loose objects and packfiles directly from the `.git` folder,
+    without spawning any processes.
+    """
+    # the maximal number of parsed commits kept in memory
+    commit_cache_size: int = 2 ** 16
+
+    def __init__(self, root: Path):
+        super().__init__(root)
+        git_root = find_vcs_root(self.root)
+        if git_root is None:
+            self._store, self._prefix = None, ()
+        else:
+            self._store = ObjectStore(*find_git_dirs(git_root))
+            relative = os.path.normpath(os.fspath(self.root.relative_to(git_root)))
+            self._prefix = tuple(Path(relative).parts) if relative != '.' else ()
+
+        self._commits = LRUCache(self.commit_cache_size)
+
+    @property
+    def cache_dir(self) -> Union[Path, None]:
+        if self._store is not None:
+            return self._store.common_dir / 'bev-cache'
+
+    def read(self, relative: str, version: CommittedVersion) -> Union[str, None]:
+        entry = self._find_entry(relative, version)
+        if entry is None or entry.is_dir or entry.mode == '160000':
+            return None
+
+        kind, content = self._store.read(entry.oid)
+        return content.decode('utf-8').strip()
+
+    def get_version(self, relative: str, n: int = 0) -> Union[str, None]:
+        if self._store is None:
+            return None
+        head = self._store.rev_parse('HEAD')
+        if head is None:
+            return None
+
+        for _, commit in self._history(head, {relative: self._split(relative)}):
+            if n == 0:
+                return commit.hex()
+            n -= 1
+
+    def _get_versions(self, relatives: Sequence[str]) -> Dict[str, Union[str, None]]:
+        result = dict.fromkeys(relatives)
+        head = None if self._store is None else self._store.rev_parse('HEAD')
+        if head is None:
+            return result
+
+        # a single walk for all the paths
+        paths = {x: self._split(x) for x in relatives}
+        for path, commit in self._history(head, paths):
+            result[path] = commit.hex()
+            # no need to follow it any further
+            del paths[path]
+            if not paths:
+                break
+
+        return result
+
+    def list_dir(self, relative: str, version: CommittedVersion) -> Sequence[TreeEntry]:
+        if self._store is None:
+            raise FileNotFoundError(f'The folder {self.root} is not inside a git repository')
+
+        entry = self._find_entry(relative, version)
+        if entry is None or not entry.is_dir:
+            raise FileNotFoundError(f'The object {relative} not found for version {version}')
+
+        return [TreeEntry(x.name, x.is_dir, x.mode == '120000') for x in self._store.read_tree(entry.oid)]
+
+    def exists(self, relative: str, version: CommittedVersion) -> bool:
+        return self._find_entry(relative, version) is not None
+
+    def find_hashes(self, version: CommittedVersion) -> Sequence[str]:
+        root = self._find_entry('.', version)
+        if root is None:
+            return []
+
+        result, queue = [], [((), root.oid)]
+        while queue:
+            parts, oid = queue.pop()
+            for entry in self._store.read_tree(oid):
+                if entry.is_dir:
+                    queue.append(((*parts, entry.name), entry.oid))
+                elif entry.name.endswith('.hash') and entry.mode != '160000':
+                    result.append('/'.join((*parts, entry.name)))
+
+        return sorted(result)
+
+    def _split(self, relative: str) -> Tuple[str, ...]:
+        relative = os.path.normpath(relative)
+        if relative == '.':
+            return self._prefix
+        return (*self._prefix, *Path(relative).parts)
+
+    def _resolve_version(self, version: CommittedVersion) -> Union[CommittedVersion, None]:
+        if self._store is not None:
+            commit = self._store.rev_parse(version)
+            if commit is not None:
+                return commit.hex()
+
+    def _find_entry(self, relative: str, version: CommittedVersion) -> Union[GitEntry, None]:
+        if self._store is None:
+            return None
+        version = self.resolve_version(version)
+        if not is_commit_hash(version):
+            return None
+
+        try:
+            tree = self._get_commit(bytes.fromhex(version)).tree
+        except (KeyError, ValueError):
+            return None
+        return self._store.find_entry(tree, self._split(relative))
+
+    def clear_caches(self):
+        super().clear_caches()
+        self._commits.clear()
+
+    def _get_commit(self, oid: Oid) -> Commit:
+        commit = self._commits.get(oid)
+        if commit is None:
+            commit = self._store.read_commit(oid)
+            self._commits.set(oid, commit)
+        return commit
+
+    def _history(self, head: Oid, paths: Dict[str, Tuple[str, ...]]) -> Iterator[Tuple[str, Oid]]:
+        """
+        Mimics the default history simplification of `git log -- path` for each of the `paths` at once.
+        Yields the (path, commit) pairs in the order `git log` would show them for each path.
+        The paths that are removed from `paths` in the meantime are no longer followed.
+        """
+        counter = 0
+        queue, seen = [(-self._get_commit(head).time, counter, head)], {(head, path) for path in paths}
+        # the paths, whose simplified histories have reached each queued commit
+        waiting = {head: set(paths)}
+        while queue:
+            _, _, oid = heapq.heappop(queue)
+            commit = self._get_commit(oid)
+            for path in waiting.pop(oid):
+                if path not in paths:
+                    continue
+
+                parts = paths[path]
+                current = self._store.find_entry(commit.tree, parts)
+                parents = commit.parents
+                same = [
+                    parent for parent in parents
+                    if self._store.find_entry(self._get_commit(parent).tree, parts) == current
+                ]
+                if same:
+                    # follow the first parent that has the same content
+                    parents = same[:1]
+                elif parents or (current is not None and (not current.is_dir or self._store.read_tree(current.oid))):
+                    # a root commit counts only if the path is there and it's not an empty root folder
+                    yield path, oid
+                    if path not in paths:
+                        continue
+
+                for parent in parents:
+                    if (parent, path) not in seen:
+                        seen.add((parent, path))
+                        if parent not in waiting:
+                            waiting[parent] = set()
+                            counter += 1
+                            heapq.heappush(queue, (-self._get_commit(parent).time, counter, parent))
+                        waiting[parent].add(path)
+
+
+class ObjectStore:
+    """ Read-only access to the objects and refs of a `.git` folder """
+
+    def __init__(self, git_dir: Path, common: Path):
+        self.git_dir, self.common_dir = git_dir, common
+        self.oid_size = 32 if _read_object_format(common) == 'sha256' else 20
+        self._object_dirs = list(_object_dirs(common / 'objects'))
+        self._packs: Dict[Path, PackFile] = {}
+        self._refresh_packs()
+
+    def read(self, oid: Oid) -> Tuple[str, bytes]:
+        result = self._find(oid)
+        if result is None:
+            # new packs might have appeared after a gc
+            self._refresh_packs()
+            result = self._find(oid)
+        if result is None:
+            raise KeyError(oid.hex())
+        return result
+
+    def read_commit(self, oid: Oid) -> Commit:
+        oid, kind, content = self._peel(oid)
+        if kind != 'commit':
+            raise ValueError(f'{oid.hex()} is not a commit')
+
+        tree, parents, time = None, [], 0
+        for line in content.split(b'\n'):
+            if not line:
+                break
+            key, _, value = line.partition(b' ')
+            if key == b'tree':
+                tree = bytes.fromhex(value.decode())
+            elif key == b'parent':
+                parents.append(bytes.fromhex(value.decode()))
+            elif key == b'committer':
+                time = int(value.rsplit(b' ', 2)[1])
+
+        return Commit(tree, tuple(parents), time)
+
+    def read_tree(self, oid: Oid) -> List[GitEntry]:
+        kind, content = self.read(oid)
+        assert kind == 'tree', kind
+        result, start = [], 0
+        while start < len(content):
+            space = content.index(b' ', start)
+            null = content.index(b'\0', space)
+            stop = null + 1 + self.oid_size
+            result.append(GitEntry(
+                content[space + 1:null].decode('utf-8'), content[start:space].decode(), content[null + 1:stop]
+            ))
+            start = stop
+
+        return result
+
+    def find_entry(self, tree: Oid, parts: Sequence[str]) -> Union[GitEntry, None]:
+        entry = GitEntry('', '40000', tree)
+        for part in parts:
+            if not entry.is_dir:
+                return None
+            entry = next((x for x in self.read_tree(entry.oid) if x.name == part), None)
+            if entry is None:
+                return None
+
+        return entry
+
+    def rev_parse(self, rev: str) -> Union[Oid, None]:
+        """ Resolve `rev` to a commit id. Supports refs, (abbreviated) object ids, as well as `~n` and `^n` """
+        suffixes = []
+        match = _REV_SUFFIX.search(rev)
+        while rev and match:
+            suffixes.append(match.group())
+            rev = rev[:match.start()]
+            match = _REV_SUFFIX.search(rev)
+
+        oid = self._resolve_name(rev)
+        if oid is None:
+            return None
+
+        with suppress(KeyError, ValueError, IndexError):
+            oid, kind, _ = self._peel(oid)
+            if kind != 'commit':
+                return None
+            for suffix in reversed(suffixes):
+                if suffix.startswith('^{'):
+                    continue
+                number = int(suffix[1:] or 1)
+                if suffix[0] == '~':
+                    for _ in range(number):
+                        oid = self.read_commit(oid).parents[0]
+                elif number:
+                    oid = self.read_commit(oid).parents[number - 1]
+
+            return oid
+
+    def _resolve_name(self, name: str) -> Union[Oid, None]:
+        if len(name) == self.oid_size * 2 and _is_hex(name):
+            return bytes.fromhex(name)
+
+        for candidate in [name, f'refs/{name}', f'refs/tags/{name}', f'refs/heads/{name}', f'refs/remotes/{name}',
+                          f'refs/remotes/{name}/HEAD']:
+            oid = self._read_ref(candidate)
+            if oid is not None:
+                return oid
+
+        if len(name) >= 4 and _is_hex(name):
+            return self._find_prefix(name.lower())
+
+    def _read_ref(self, name: str, depth: int = 0) -> Union[Oid, None]:
+        if depth > 5 or not name:
+            return None
+
+        for folder in {self.git_dir, self.common_dir}:
+            path = folder / name
+            if path.is_file():
+                with open(path, 'r') as file:
+                    value = file.read().strip()
+                if value.startswith('ref:'):
+                    return self._read_ref(value[4:].strip(), depth + 1)
+                if _is_hex(value):
+                    return bytes.fromhex(value)
+
+        packed = self.common_dir / 'packed-refs'
+        if packed.exists():
+            with open(packed, 'r') as file:
+                for line in file:
+                    if line.startswith(('#', '^')):
+                        continue
+                    value, _, ref = line.strip().partition(' ')
+                    if ref == name:
+                        return bytes.fromhex(value)
+
+    def _find_prefix(self, prefix: str) -> Union[Oid, None]:
+        found = set()
+        for pack in self._packs.values():
+            found.update(pack.find_prefix(prefix))
+        for objects in self._object_dirs:
+            folder = objects / prefix[:2]
+            if folder.is_dir():
+                found.update(
+                    bytes.fromhex(prefix[:2] + file.name) for file in folder.iterdir()
+                    if file.name.startswith(prefix[2:]) and _is_hex(file.name)
+                )
+
+        if len(found) == 1:
+            return found.pop()
+
+    def _peel(self, oid: Oid) -> Tuple[Oid, str, bytes]:
+        kind, content = self.read(oid)
+        while kind == 'tag':
+            oid = bytes.fromhex(content.split(b'\n', 1)[0].split(b' ')[1].decode())
+            kind, content = self.read(oid)
+        return oid, kind, content
+
+    def _find(self, oid: Oid) -> Union[Tuple[str, bytes], None]:
+        for pack in self._packs.values():
+            offset = pack.find(oid)
+            if offset is not None:
+                return pack.read(offset, self.read)
+
+        name = oid.hex()
+        for objects in self._object_dirs:
+            path = objects / name[:2] / name[2:]
+            if path.exists():
+                with open(path, 'rb') as file:
+                    raw = zlib.decompress(file.read())
+                header, _, content = raw.partition(b'\0')
+                kind, size = header.decode().split(' ')
+                assert int(size) == len(content), (size, len(content))
+                return kind, content
+
+    def _refresh_packs(self):
+        for objects in self._object_dirs:
+            folder = objects / 'pack'
+            if folder.is_dir():
+                for index in folder.glob('*.idx'):
+                    pack = index.with_suffix('.pack')
+                    if index not in self._packs and pack.exists():
+                        self._packs[index] = PackFile(index, pack, self.oid_size)
+
+
+class PackFile:
+    def __init__(self, index: Path, pack: Path, oid_size: int):
+        self.oid_size = oid_size
+        self._index = _map(index)
+        self._pack = _map(pack)
+        if self._index[:4] != b'\377tOc' or int.from_bytes(self._index[4:8], 'big') != 2:
+            raise ValueError(f'Unsupported pack index format: {index}')
+
+        self._fanout = [int.from_bytes(self._index[8 + i * 4:12 + i * 4], 'big') for i in range(256)]
+        self._count = self._fanout[-1]
+        self._oids = 8 + 256 * 4
+        self._offsets = self._oids + self._count * (oid_size + 4)
+        self._large_offsets = self._offsets + self._count * 4
+
+    def find(self, oid: Oid) -> Union[int, None]:
+        first = oid[0]
+        start = self._fanout[first - 1] if first else 0
+        idx = bisect_left(_OidView(self), oid, start, self._fanout[first])
+        if idx < self._fanout[first] and self._oid(idx) == oid:
+            return self._offset(idx)
+
+    def find_prefix(self, prefix: str) -> Iterator[Oid]:
+        low = bytes.fromhex(prefix[:len(prefix) // 2 * 2])
+        idx = bisect_left(_OidView(self), low, 0, self._count)
+        while idx < self._count:
+            oid = self._oid(idx)
+            if not oid.hex().startswith(prefix[:len(low) * 2]):
+                break
+            if oid.hex().startswith(prefix):
+                yield oid
+            idx += 1
+
+    def read(self, offset: int, read_ref) -> Tuple[str, bytes]:
+        deltas = []
+        while True:
+            kind, size, position = self._header(offset)
+            if kind == _OFS_DELTA:
+                shift, position = _read_offset(self._pack, position)
+                deltas.append(self._inflate(position))
+                offset -= shift
+
+            elif kind == _REF_DELTA:
+                base = self._pack[position:position + self.oid_size]
+                deltas.append(self._inflate(position + self.oid_size))
+                offset = self.find(base)
+                if offset is None:
+                    kind, content = read_ref(base)
+                    break
+
+            else:
+                kind, content = _TYPES[kind], self._inflate(position)
+                assert len(content) == size, (len(content), size)
+                break
+
+        for delta in reversed(deltas):
+            content = _apply_delta(content, delta)
+        return kind, content
+
+    def _oid(self, idx: int) -> Oid:
+        start = self._oids + idx * self.oid_size
+        return self._index[start:start + self.oid_size]
+
+    def _offset(self, idx: int) -> int:
+        start = self._offsets + idx * 4
+        offset = int.from_bytes(self._index[start:start + 4], 'big')
+        if offset & 0x80000000:
+            start = self._large_offsets + (offset & 0x7fffffff) * 8
+            offset = int.from_bytes(self._index[start:start + 8], 'big')
+        return offset
+
+    def _header(self, position: int):
+        byte = self._pack[position]
+        kind, size, shift = (byte >> 4) & 7, byte & 15, 4
+        position += 1
+        while byte & 0x80:
+            byte = self._pack[position]
+            size |= (byte & 0x7f) << shift
+            shift += 7
+            position += 1
+
+        return kind, size, position
+
+    def _inflate(self, position: int) -> bytes:
+        decompressor, chunks = zlib.decompressobj(), []
+        while not decompressor.eof:
+            chunk = self._pack[position:position + 2 ** 16]
+            if not chunk:
+                raise ValueError('Unexpected end of packfile')
+            chunks.append(decompressor.decompress(chunk))
+            position += len(chunk)
+
+        return b''.join(chunks)
+
+
+class _OidView:
+    """ Lazy sequence of object ids inside a pack index, used for bisection """
+
+    def __init__(self, pack: PackFile):
+        self.pack = pack
+
+    def __getitem__(self, idx):
+        return self.pack._oid(idx)
+
+    def __len__(self):
+        return self.pack._count
+
+
+def _apply_delta(base: bytes, delta: bytes) -> bytes:
+    def varint(position):
+        value = shift = 0
+        while True:
+            byte = delta[position]
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            position += 1
+            if not byte & 0x80:
+                return value, position
+
+    source_size, position = varint(0)
+    target_size, position = varint(position)
+    assert source_size == len(base), (source_size, len(base))
+
+    result = bytearray()
+    while position < len(delta):
+        command = delta[position]
+        position += 1
+        if command & 0x80:
+            offset = size = 0
+            for i in range(4):
+                if command & (1 << i):
+                    offset |= delta[position] << (i * 8)
+                    position += 1
+            for i in range(3):
+                if command & (1 << (4 + i)):
+                    size |= delta[position] << (i * 8)
+                    position += 1
+
+            result += base[offset:offset + (size or 0x10000)]
+
+        elif command:
+            result += delta[position:position + command]
+            position += command
+
+        else:
+            raise ValueError('Invalid delta instruction')
+
+    assert len(result) == target_size, (len(result), target_size)
+    return bytes(result)
+
+
+def _read_offset(data, position):
+    byte = data[position]
+    offset = byte & 0x7f
+    position += 1
+    while byte & 0x80:
+        byte = data[position]
+        offset = ((offset + 1) << 7) | (byte & 0x7f)
+        position += 1
+
+    return offset, position
+
+
+def _object_dirs(objects: Path):
+    yield objects
+    alternates = objects / 'info' / 'alternates'
+    if alternates.exists():
+        with open(alternates, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield from _object_dirs(objects / line)
+
+
+def _read_object_format(git_dir: Path):
+    config = git_dir / 'config'
+    if config.exists():
+        with open(config, 'r') as file:
+            match = re.search(r'^\s*objectformat\s*=\s*(\w+)', file.read(), re.MULTILINE | re.IGNORECASE)
+            if match:
+                return match.group(1).lower()
+
+
+def _map(path: Path):
+    with open(path, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _is_hex(value: str):
+    return bool(value) and all(c in '0123456789abcdefABCDEF' for c in value)
@@ -1,3 +1,4 @@
+from collections.abc import Mapping
 from enum import Enum
 from pathlib import Path
 from typing import Callable, Optional, Union
@@ -5,7 +6,7 @@ from typing import Callable, Optional, Union
 from tarn import HashKeyStorage
 
 from .config import identity
-from .hash import HashType, from_hash, is_hash, is_tree, load_key, load_tree, normalize_tree, strip_tree, tree_to_hash
+from .hash import HashType, from_hash, is_hash, is_tree, load_key, normalize_tree, read_tree, tree_to_hash
 from .interface import Repository
 from .utils import PathOrStr
 
@@ -40,7 +41,7 @@ def gather(source: PathOrStr, storage: Union[HashKeyStorage, Repository], progre
     if is_hash(source):
         key = load_key(source)
         if is_tree(key):
-            gathered = normalize_tree(storage.read(load_tree, strip_tree(key), fetch=fetch), storage.digest_size)
+            gathered = normalize_tree(read_tree(storage, key, fetch), storage.digest_size)
         else:
             gathered = key
 
@@ -53,7 +54,7 @@ def gather(source: PathOrStr, storage: Union[HashKeyStorage, Repository], progre
                     if is_hash(child):
                         key = load_key(child)
                         if is_tree(key):
-                            key = storage.read(load_tree, strip_tree(key), fetch=fetch)
+                            key = read_tree(storage, key, fetch)
 
                         gathered[from_hash(relative)] = key
 
@@ -72,15 +73,20 @@ def gather(source: PathOrStr, storage: Union[HashKeyStorage, Repository], progre
 def load_hash(path: PathOrStr, storage, fetch: bool = False) -> HashType:
     key = load_key(path)
     if is_tree(key):
-        return normalize_tree(storage.read(load_tree, strip_tree(key), fetch=fetch), storage.digest_size)
+        return normalize_tree(read_tree(storage, key, fetch), storage.digest_size)
     return key
 
 
-def save_hash(tree: HashType, path: PathOrStr, storage: Union[HashKeyStorage, Repository]):
+def save_hash(tree: HashType, path: PathOrStr, storage: Union[HashKeyStorage, Repository],
+              tree_format: Optional[str] = None, nested: Optional[bool] = None):
     if isinstance(storage, Repository):
+        if tree_format is None:
+            tree_format = storage.tree_format
+        if nested is None:
+            nested = storage.nested_trees
         storage = storage.storage
-    if isinstance(tree, dict):
-        tree = tree_to_hash(tree, storage)
+    if isinstance(tree, Mapping):
+        tree = tree_to_hash(tree, storage, tree_format or 'json', bool(nested))
 
     with open(path, 'w') as file:
         file.write(tree)
@@ -0,0 +1,78 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Dict, Optional, Sequence
+
+from tarn import HashKeyStorage
+
+
+class Fetcher:
+    """
+    Fetches keys from the remote storage locations.
+
+    If an `executor` is provided, the keys are split in chunks of `chunk_size`, which are fetched in parallel.
+    A key requested by several threads at the same time is fetched only once.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None, chunk_size: int = 16):
+        self.executor, self.chunk_size = executor, chunk_size
+        # the worker threads don't survive a fork
+        self._pid = os.getpid()
+        self._pending: Dict[bytes, Future] = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, storage: HashKeyStorage, keys: Sequence[bytes]) -> Dict[bytes, bool]:
+        """ Fetch the `keys` into the `storage` and report whether each of them was successfully fetched """
+        own, others = {}, {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if key in self._pending:
+                    others[key] = self._pending[key]
+                else:
+                    own[key] = self._pending[key] = Future()
+
+        try:
+            result = self._fetch(storage, list(own))
+        except BaseException as e:
+            for future in own.values():
+                future.set_exception(e)
+            raise
+        else:
+            for key, future in own.items():
+                future.set_result(result.get(key, False))
+        finally:
+            with self._lock:
+                for key in own:
+                    self._pending.pop(key, None)
+
+        for key, future in others.items():
+            result[key] = future.result()
+        return result
+
+    def _fetch(self, storage: HashKeyStorage, keys: Sequence[bytes]) -> Dict[bytes, bool]:
+        if not keys:
+            return {}
+        if self.executor is None or self._pid != os.getpid() or len(keys) <= self.chunk_size:
+            return dict(storage.fetch(keys))
+
+        chunks = deque(keys[i:i + self.chunk_size] for i in range(0, len(keys), self.chunk_size))
+
+        def take():
+            try:
+                chunk = chunks.popleft()
+            except IndexError:
+                return {}
+            return dict(storage.fetch(chunk))
+
+        futures = [self.executor.submit(take) for _ in range(len(chunks) - 1)]
+        # the calling thread takes the chunks as well, so if all the workers are busy, e.g. because this
+        # call comes from one of them, it simply does all the work itself instead of waiting for them
+        result = {}
+        while chunks:
+            result.update(take())
+        for future in futures:
+            # only wait for the chunks the workers have actually taken
+            if not future.cancel():
+                result.update(future.result())
+        return result
@@ -14,7 +14,7 @@ PathOrStr = Union[str, PathLike]
 def call_git(command: str, cwd=None, wrap=False) -> str:
     try:
         return subprocess.check_output(
-            shlex.split(command), cwd=cwd, stderr=subprocess.STD_ERROR_HANDLE if wrap else subprocess.DEVNULL
+            shlex.split(command), cwd=cwd, stderr=subprocess.PIPE if wrap else subprocess.DEVNULL
         ).decode('utf-8').strip()
     except subprocess.CalledProcessError as e:
         if wrap:
@@ -1,17 +1,21 @@
 import os
 import shlex
 import subprocess
+import threading
+import time
 from abc import abstractmethod
 from contextlib import suppress
-from functools import lru_cache
 from pathlib import Path
-from typing import NamedTuple, Sequence, Union
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple, Union
 
+from .aio import IO, InFlight, arun_io, call_git_async, run_blocking, run_io
+from .cache import DiskCache, LRUCache
 from .config import find_vcs_root
 from .local import LocalVersion
 
 CommittedVersion = str
 Version = Union[CommittedVersion, LocalVersion]
+_missing = object()
 
 
 class TreeEntry(NamedTuple):
@@ -21,8 +25,65 @@ class TreeEntry(NamedTuple):
 
 
 class VC:
+    # how long, in seconds, a resolved symbolic version (e.g. a branch name) is considered valid
+    version_ttl: float = 1
+    # the maximal size in bytes of each of the persistent caches inside `cache_dir`
+    disk_cache_size: int = 2 ** 28
+
     def __init__(self, root: Path):
         self.root = root
+        self._versions: Dict[str, Tuple[CommittedVersion, float]] = {}
+        self._in_flight = InFlight()
+        self._disk_caches: Dict[str, DiskCache] = {}
+
+    @property
+    def cache_dir(self) -> Union[Path, None]:
+        """
+        The folder for persistent caches or None, if they are not supported.
+        The caches only speed things up, so the folder can be safely removed at any moment.
+        """
+
+    def resolve_version(self, version: CommittedVersion) -> CommittedVersion:
+        """
+        Get the full commit hash for a `version`: a tag, a branch, an abbreviated hash etc.
+        Returns the `version` as is, if it can't be resolved.
+        """
+        resolved = self._get_resolved(version)
+        if resolved is None:
+            resolved = self._set_resolved(version, self._resolve_version(version))
+        return resolved
+
+    async def aresolve_version(self, version: CommittedVersion) -> CommittedVersion:
+        """ Same as `resolve_version`, but doesn't block the event loop """
+        resolved = self._get_resolved(version)
+        if resolved is None:
+            resolved = self._set_resolved(
+                version, await self._in_flight.run(('version', version), lambda: self._aresolve_version(version))
+            )
+        return resolved
+
+    def clear_caches(self):
+        """ Drop all the in-memory caches """
+        self._versions.clear()
+
+    def _resolve_version(self, version: CommittedVersion) -> Union[CommittedVersion, None]:
+        """ Get the full commit hash for a `version` or None, if it doesn't exist """
+
+    async def _aresolve_version(self, version: CommittedVersion) -> Union[CommittedVersion, None]:
+        return await run_blocking(self._resolve_version, version)
+
+    def _get_resolved(self, version: CommittedVersion) -> Union[CommittedVersion, None]:
+        if is_commit_hash(version):
+            return version
+
+        resolved, timestamp = self._versions.get(version, (None, None))
+        if timestamp is not None and time.monotonic() - timestamp < self.version_ttl:
+            return resolved
+
+    def _set_resolved(self, version: CommittedVersion, resolved: Union[CommittedVersion, None]) -> CommittedVersion:
+        resolved = resolved or version
+        self._versions[version] = resolved, time.monotonic()
+        return resolved
 
     @abstractmethod
     def read(self, relative: str, version: CommittedVersion) -> Union[str, None]:
@@ -31,6 +92,10 @@ class VC:
         or None, if the file doesn't exist.
         """
 
+    async def aread(self, relative: str, version: CommittedVersion) -> Union[str, None]:
+        """ Same as `read`, but doesn't block the event loop """
+        return await run_blocking(self.read, relative, version)
+
     @abstractmethod
     def get_version(self, relative: str, n: int = 0) -> Union[str, None]:
         """
@@ -40,23 +105,134 @@ class VC:
         E.g. for n=0 - this will be the most recent version.
         """
 
+    def get_versions(self, relatives: Sequence[str]) -> Dict[str, Union[str, None]]:
+        """
+        Same as `get_version` with n=0, but for multiple files at once.
+        The results are memoized on disk for each HEAD commit.
+        """
+        relatives = [os.path.normpath(x) for x in relatives]
+        cache, head = self._disk_cache('latest'), self.resolve_version('HEAD')
+        if cache is not None and is_commit_hash(head):
+            key = f'{head}:{Path(self.root).resolve()}'
+            memo = cache.get(key, {})
+        else:
+            cache = key = None
+            memo = {}
+
+        missing = sorted(set(relatives) - set(memo))
+        if missing:
+            memo.update(self._get_versions(missing))
+            if cache is not None:
+                cache.set(key, memo)
+
+        return {x: memo[x] for x in relatives}
+
+    def _get_versions(self, relatives: Sequence[str]) -> Dict[str, Union[str, None]]:
+        return {x: self.get_version(x) for x in relatives}
+
+    def _disk_cache(self, name: str) -> Union[DiskCache, None]:
+        root = self.cache_dir
+        if root is None:
+            return None
+
+        # the instances are reused, because each of them keeps track of the written size
+        cache = self._disk_caches.get(name)
+        if cache is None:
+            cache = self._disk_caches.setdefault(name, DiskCache(root / name, self.disk_cache_size))
+        return cache
+
     @abstractmethod
     def list_dir(self, relative: str, version: CommittedVersion) -> Sequence[TreeEntry]:
         """ Get the contents of a directory `relative` to the root given `version` """
 
+    def exists(self, relative: str, version: CommittedVersion) -> bool:
+        """ Whether the path `relative` to the root exists at a given `version` """
+        parent, name = os.path.split(os.path.normpath(relative))
+        try:
+            return name in {x.name for x in self.list_dir(parent or '.', version)}
+        except FileNotFoundError:
+            return False
+
+    def find_hashes(self, version: CommittedVersion) -> Sequence[str]:
+        """ Get all the hash files at a given `version`, relative to the root """
+        result, queue = [], ['.']
+        while queue:
+            parent = queue.pop()
+            for entry in self.list_dir(parent, version):
+                relative = os.path.normpath(os.path.join(parent, entry.name))
+                if entry.is_dir:
+                    queue.append(relative)
+                elif relative.endswith('.hash'):
+                    result.append(relative)
+
+        return sorted(result)
+
+    async def afind_hashes(self, version: CommittedVersion) -> Sequence[str]:
+        """ Same as `find_hashes`, but doesn't block the event loop """
+        return await run_blocking(self.find_hashes, version)
+
 
 class SubprocessGit(VC):
+    # the maximal number of cached file contents and commit indices respectively
+    read_cache_size: int = 2 ** 16
+    index_cache_size: int = 16
+
     def __init__(self, root: Path):
         super().__init__(root)
         self._git_root = None
+        self._reads = LRUCache(self.read_cache_size)
+        self._indices = LRUCache(self.index_cache_size)
 
-    @lru_cache(None)
     def read(self, relative: str, version: CommittedVersion) -> Union[str, None]:
-        if not relative.startswith('./'):
-            relative = f'./{relative}'
+        key = relative, self.resolve_version(version)
+        content = self._reads.get(key, _missing)
+        if content is _missing:
+            content = self._read(*key)
+            self._reads.set(key, content)
+        return content
+
+    async def aread(self, relative: str, version: CommittedVersion) -> Union[str, None]:
+        key = relative, await self.aresolve_version(version)
+        content = self._reads.get(key, _missing)
+        if content is _missing:
+            content = await self._in_flight.run(('read', key), lambda: self._aread(*key))
+            self._reads.set(key, content)
+        return content
+
+    def clear_caches(self):
+        super().clear_caches()
+        self._reads.clear()
+        self._indices.clear()
+
+    def _read(self, relative: str, version: CommittedVersion) -> Union[str, None]:
+        return run_io(self._read_steps(relative, self._tree_index(version)))
 
+    async def _aread(self, relative: str, version: CommittedVersion) -> Union[str, None]:
+        return await arun_io(self._read_steps(relative, await self._atree_index(version)))
+
+    def _read_steps(self, relative: str, index: 'TreeIndex'):
+        # most of the reads are probes for missing hashes, the index answers them without calling git
+        oid = index.get_blob(relative)
+        if oid is None:
+            return None
+
+        # the blobs are immutable, so they can be safely shared between processes
+        cache = self._disk_cache('blobs')
+        content = cache.get(oid) if cache is not None else None
+        if content is None:
+            content = yield IO(self._read_blob, self._aread_blob, (oid,))
+            if content is not None and cache is not None:
+                cache.set(oid, content)
+
+        return content
+
+    def _read_blob(self, oid: str) -> Union[str, None]:
         with suppress(subprocess.CalledProcessError):
-            return self._call_git(f'git show {version}:{relative}', self.root)
+            return self._call_git(f'git cat-file blob {oid}', self._git_root)
+
+    async def _aread_blob(self, oid: str) -> Union[str, None]:
+        with suppress(subprocess.CalledProcessError):
+            return await call_git_async(f'git cat-file blob {oid}', self._git_root)
 
     def get_version(self, relative: str, n: int = 0) -> Union[str, None]:
         if n == 0:
@@ -70,30 +246,408 @@ class SubprocessGit(VC):
         with suppress(subprocess.CalledProcessError):
             return self._call_git(f'git log -n 1 {n} --pretty=format:%H -- {relative}', self.root) or None
 
-    @lru_cache(None)
-    def list_dir(self, relative: str, version: CommittedVersion) -> Sequence[TreeEntry]:
-        if self._git_root is None:
-            self._git_root = find_vcs_root(self.root)
-        if self._git_root is None:
-            raise FileNotFoundError(f'The folder {self.root} is not inside a git repository')
+    def _get_versions(self, relatives: Sequence[str]) -> Dict[str, Union[str, None]]:
+        result = dict.fromkeys(relatives)
+        if self._get_git_root() is None:
+            return result
 
-        git_relative = os.path.normpath(os.fspath((self.root / relative).relative_to(self._git_root)))
-        suffix = f':{git_relative}' if git_relative != '.' else ''
-        result = []
+        # git simplifies the history for the whole set of paths at once, so we list all the commits with their
+        # changes against each parent, and simplify the history of each path ourselves, the same way `get_version` does
+        process = subprocess.Popen(
+            ['git', '-c', 'log.diffMerges=separate', 'log', '--pretty=raw', '--no-abbrev-commit', '--no-decorate',
+             '--no-show-signature', '-m', '--full-history', '--sparse', '--name-only', '--no-renames', '--relative',
+             '-z', '--', *(f'./{x}' for x in relatives)],
+            cwd=self.root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
         try:
-            lines = self._call_git(f'git ls-tree {version}{suffix}', self._git_root).splitlines()
-        except subprocess.CalledProcessError as e:
-            if e.returncode == 128:
-                raise FileNotFoundError(f'The object {git_relative} not found for version {version}') from None
-            raise
+            left, waiting, pending = set(relatives), None, dict.fromkeys(relatives, 1)
+            for commit, parents, changes in _parse_log(process.stdout):
+                # the history is listed starting from HEAD
+                if waiting is None:
+                    waiting = {commit: set(relatives)}
+
+                changed = {
+                    parent: {x for file in files for x in _with_parents(file)} for parent, files in changes.items()
+                }
+                # the paths, whose simplified histories have reached this commit
+                for path in waiting.pop(commit, ()):
+                    if path not in left:
+                        continue
+
+                    pending[path] -= 1
+                    same = [parent for parent in parents if path not in changed.get(parent, ())]
+                    if same:
+                        # follow the first parent that has the same content
+                        if path not in waiting.setdefault(same[0], set()):
+                            waiting[same[0]].add(path)
+                            pending[path] += 1
+                    elif parents or path in changed.get(None, ()):
+                        left.remove(path)
+                        result[path] = commit
+                        continue
 
-        for line in lines:
-            mode, kind, rest = line.split(' ', 2)
-            _, name = rest.split('\t')
-            result.append(TreeEntry(name, kind == 'tree', kind == 'link'))
+                    # the simplified history has ended without finding the path
+                    if not pending[path]:
+                        left.remove(path)
+
+                if not left:
+                    break
+
+        finally:
+            process.kill()
+            process.wait()
+            process.stdout.close()
 
         return result
 
+    def list_dir(self, relative: str, version: CommittedVersion) -> Sequence[TreeEntry]:
+        if self._get_git_root() is None:
+            raise FileNotFoundError(f'The folder {self.root} is not inside a git repository')
+
+        result = self._tree_index(self.resolve_version(version)).list_dir(relative)
+        if result is None:
+            raise FileNotFoundError(f'The object {self._git_relative(relative)} not found for version {version}')
+        return result
+
+    def exists(self, relative: str, version: CommittedVersion) -> bool:
+        return self._tree_index(self.resolve_version(version)).exists(relative)
+
+    def find_hashes(self, version: CommittedVersion) -> Sequence[str]:
+        return self._tree_index(self.resolve_version(version)).find_hashes()
+
+    async def afind_hashes(self, version: CommittedVersion) -> Sequence[str]:
+        return (await self._atree_index(await self.aresolve_version(version))).find_hashes()
+
+    def _resolve_version(self, version: CommittedVersion) -> Union[CommittedVersion, None]:
+        return run_io(self._resolve_version_steps(version))
+
+    async def _aresolve_version(self, version: CommittedVersion) -> Union[CommittedVersion, None]:
+        return await arun_io(self._resolve_version_steps(version))
+
+    def _resolve_version_steps(self, version: CommittedVersion):
+        root = self._get_git_root()
+        if root is None:
+            return None
+
+        with suppress(subprocess.CalledProcessError):
+            return (yield self._git(f'git rev-parse --verify --quiet {shlex.quote(version + "^{commit}")}', root))
+
+    def _tree_index(self, version: CommittedVersion) -> 'TreeIndex':
+        index = self._indices.get(version)
+        if index is None:
+            index = run_io(self._load_tree_index_steps(version))
+            self._indices.set(version, index)
+        return index
+
+    async def _atree_index(self, version: CommittedVersion) -> 'TreeIndex':
+        index = self._indices.get(version)
+        if index is None:
+            index = await self._in_flight.run(('index', version), lambda: arun_io(self._load_tree_index_steps(version)))
+            self._indices.set(version, index)
+        return index
+
+    def _load_tree_index_steps(self, version: CommittedVersion):
+        if self._get_git_root() is None:
+            return TreeIndex.missing()
+
+        cache, key = self._index_cache(version)
+        output = cache.get(key) if cache is not None else None
+        if output is None:
+            try:
+                output = yield self._git(f'git ls-tree -r -t -z {shlex.quote(key)}', self._git_root)
+            except subprocess.CalledProcessError as e:
+                if e.returncode == 128:
+                    return TreeIndex.missing()
+                raise
+
+            if cache is not None:
+                cache.set(key, output)
+
+        return TreeIndex.from_ls_tree(output)
+
+    def _index_cache(self, version: CommittedVersion) -> Tuple[Union[DiskCache, None], str]:
+        """ The tree-ish of the root at `version` and the persistent cache for its index """
+        git_relative = self._git_relative('.')
+        key = f'{version}:{git_relative}' if git_relative != '.' else version
+        # a commit's contents never change, so its index can be shared between processes
+        cache = self._disk_cache('trees') if is_commit_hash(version) else None
+        return cache, key
+
+    @property
+    def cache_dir(self) -> Union[Path, None]:
+        root = self._get_git_root()
+        if root is not None:
+            return find_git_dirs(root)[1] / 'bev-cache'
+
+    def _get_git_root(self):
+        if self._git_root is None:
+            self._git_root = find_vcs_root(self.root)
+        return self._git_root
+
+    def _git_relative(self, relative: str) -> str:
+        return os.path.normpath(os.fspath((self.root / relative).relative_to(self._get_git_root())))
+
     @staticmethod
     def _call_git(command: str, cwd) -> str:
         return subprocess.check_output(shlex.split(command), cwd=cwd, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+
+    def _git(self, command: str, cwd) -> IO:
+        return IO(self._call_git, call_git_async, (command, cwd))
+
+
+class TreeIndex:
+    """ A snapshot of all the paths inside a single commit """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, str, str]], exists: bool = True):
+        # path -> (type, object id)
+        self.objects: Dict[str, Tuple[str, str]] = {}
+        self.dirs: Dict[str, List[TreeEntry]] = {'.': []} if exists else {}
+
+        for mode, kind, oid, path in entries:
+            parent, name = os.path.split(path)
+            self.objects[path] = kind, oid
+            self.dirs.setdefault(parent or '.', []).append(TreeEntry(name, kind == 'tree', mode == '120000'))
+            if kind == 'tree':
+                self.dirs.setdefault(path, [])
+
+    @classmethod
+    def from_ls_tree(cls, output: str) -> 'TreeIndex':
+        """ Parse the output of `git ls-tree -r -t -z` """
+
+        def entries():
+            for record in output.split('\0'):
+                if record:
+                    info, path = record.split('\t', 1)
+                    mode, kind, oid = info.split(' ')
+                    yield mode, kind, oid, path
+
+        return cls(entries())
+
+    @classmethod
+    def missing(cls) -> 'TreeIndex':
+        return cls((), exists=False)
+
+    def list_dir(self, relative: str) -> Union[Sequence[TreeEntry], None]:
+        return self.dirs.get(os.path.normpath(relative))
+
+    def exists(self, relative: str) -> bool:
+        relative = os.path.normpath(relative)
+        return relative in self.objects or relative in self.dirs
+
+    def get_blob(self, relative: str) -> Union[str, None]:
+        """ The object id of a file `relative` to the root """
+        kind, oid = self.objects.get(os.path.normpath(relative), (None, None))
+        if kind == 'blob':
+            return oid
+
+    def find_hashes(self) -> Sequence[str]:
+        return sorted(path for path, (kind, _) in self.objects.items() if kind == 'blob' and path.endswith('.hash'))
+
+
+class CatFileGit(SubprocessGit):
+    """
+    Same as `SubprocessGit`, but the files are read through a single long-lived `git cat-file --batch` process
+    instead of spawning a new `git show` for each file.
+    """
+
+    def __init__(self, root: Path):
+        super().__init__(root)
+        self._cat_file = CatFile(self._get_git_root() or self.root)
+
+    def _read_blob(self, oid: str) -> Union[str, None]:
+        result = self._cat_file.read(oid)
+        if result is None or result.kind != 'blob':
+            return None
+        return result.content.decode('utf-8').strip()
+
+    async def _aread_blob(self, oid: str) -> Union[str, None]:
+        # the pipe is shared, so the reads from the event loop don't spawn new processes
+        return await run_blocking(self._read_blob, oid)
+
+    def _resolve_version_steps(self, version: CommittedVersion):
+        result = yield IO.blocking(self._cat_file.read, f'{version}^{{commit}}')
+        if result is not None:
+            return result.oid
+
+
+class GitObject(NamedTuple):
+    oid: str
+    kind: str
+    content: bytes
+
+
+class CatFile:
+    """ A wrapper around a `git cat-file --batch` process, which is restarted on failure """
+
+    def __init__(self, cwd: Path):
+        self.cwd = cwd
+        self._process = self._pid = None
+        self._lock = threading.Lock()
+
+    def read(self, name: str) -> Union[GitObject, None]:
+        """
+        Get the id, type and contents of the object `name` or None, if the object doesn't exist.
+        """
+        return self.read_many([name])[0]
+
+    def read_many(self, names: Sequence[str]) -> List[Union[GitObject, None]]:
+        """ Same as `read`, but the requests are sent in batches """
+        for name in names:
+            if '\n' in name:
+                raise ValueError(f'Object names with line breaks are not supported: {name!r}')
+
+        result = []
+        with self._lock:
+            for batch in _batches(names, self._max_request):
+                try:
+                    result.extend(self._query(batch))
+                except (OSError, ValueError):
+                    # the process might have died, or the stream got corrupted - one more try with a fresh process
+                    self._close()
+                    result.extend(self._query(batch))
+
+        return result
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    # the whole request must fit into the pipe's buffer, otherwise both processes might block on writing
+    _max_request = 2 ** 14
+
+    def _query(self, names: Sequence[str]):
+        process = self._get_process()
+        process.stdin.write(b''.join(name.encode('utf-8') + b'\n' for name in names))
+        process.stdin.flush()
+        return [self._response(process, name) for name in names]
+
+    @staticmethod
+    def _response(process, name: str):
+        header = process.stdout.readline()
+        if not header.endswith(b'\n'):
+            raise ValueError(f'Unexpected end of stream while reading "{name}"')
+
+        parts = header.decode('utf-8').split()
+        if len(parts) != 3 or not parts[2].isdigit():
+            # missing or ambiguous
+            return None
+
+        oid, kind, size = parts
+        size = int(size)
+        content = process.stdout.read(size + 1)
+        if len(content) != size + 1:
+            raise ValueError(f'Unexpected end of stream while reading "{name}"')
+        return GitObject(oid, kind, content[:-1])
+
+    def _get_process(self):
+        # a process inherited from the parent after `fork` cannot be shared
+        if self._process is None or self._pid != os.getpid() or self._process.poll() is not None:
+            self._close()
+            self._process = subprocess.Popen(
+                ['git', 'cat-file', '--batch'], cwd=self.cwd,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            )
+            self._pid = os.getpid()
+
+        return self._process
+
+    def _close(self):
+        process, self._process = self._process, None
+        if process is not None and self._pid == os.getpid():
+            with suppress(OSError):
+                process.stdin.close()
+            with suppress(OSError):
+                process.kill()
+            process.wait()
+            process.stdout.close()
+
+    def __del__(self):
+        with suppress(Exception):
+            self._close()
+
+
+def is_commit_hash(version: CommittedVersion) -> bool:
+    """ Whether the `version` is a full sha1 or sha256 hash """
+    return len(version) in (40, 64) and all(c in '0123456789abcdef' for c in version)
+
+
+def find_git_dirs(git_root: Path) -> Tuple[Path, Path]:
+    """ Get the git folder and the common git folder (they differ for worktrees) for a given worktree root """
+    git_dir = git_root / '.git'
+    # worktrees and submodules
+    if git_dir.is_file():
+        with open(git_dir, 'r') as file:
+            link = file.read().strip()
+        assert link.startswith('gitdir:'), link
+        git_dir = git_root / link[len('gitdir:'):].strip()
+
+    common = git_dir
+    if (git_dir / 'commondir').exists():
+        with open(git_dir / 'commondir', 'r') as file:
+            common = git_dir / file.read().strip()
+
+    return git_dir, common
+
+
+def _batches(names: Sequence[str], max_size: int):
+    batch, size = [], 0
+    for name in names:
+        if batch and size + len(name) + 1 > max_size:
+            yield batch
+            batch, size = [], 0
+
+        batch.append(name)
+        size += len(name) + 1
+
+    if batch:
+        yield batch
+
+
+def _parse_log(stream) -> Iterator[Tuple[str, List[str], Dict[Union[str, None], List[str]]]]:
+    """
+    Parse the output of `git log --pretty=raw -m --name-only -z` into (commit, parents, changes) triplets,
+    where `changes` maps each parent to the list of changed files. A root commit is compared against None.
+    The parents without changes are missing from `changes`.
+    """
+    commit, parents, changes, files, header, buffer = None, [], {}, [], True, b''
+    for chunk in iter(lambda: stream.read(2 ** 16), b''):
+        *tokens, buffer = (buffer + chunk).split(b'\0')
+        for token in tokens:
+            if not token:
+                # the end of the file list
+                header = True
+
+            elif not header:
+                files.append(token.decode('utf-8'))
+
+            else:
+                # "commit <hash> (from <parent>)", the other headers, the indented message and the first file
+                head, _, rest = token.partition(b'\n\n')
+                lines = head.decode('utf-8', 'replace').splitlines()
+                current, *source = lines[0].split()[1:]
+                if current != commit:
+                    if commit is not None:
+                        yield commit, parents, changes
+                    commit, changes = current, {}
+                    parents = [line.split()[1] for line in lines[1:] if line.startswith('parent ')]
+
+                if source:
+                    parent = source[1].rstrip(')')
+                else:
+                    parent = parents[0] if parents else None
+                files = changes.setdefault(parent, [])
+
+                header = not rest or rest.endswith(b'\n')
+                if not header:
+                    start = rest.rfind(b'\n\n')
+                    files.append((rest[start + 2:] if start >= 0 else rest.lstrip(b'\n')).decode('utf-8'))
+
+    if commit is not None:
+        yield commit, parents, changes
+
+
+def _with_parents(relative: str):
+    yield relative
+    while relative:
+        relative = os.path.dirname(relative)
+        yield relative or '.'
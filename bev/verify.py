@@ -0,0 +1,59 @@
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+from tarn.digest import digest_value
+
+from .cache import DiskCache, LRUCache
+
+
+class Verifier:
+    """
+    Computes the digests of the files from the storage and remembers them.
+
+    A file is identified by its (device, inode, size, mtime_ns), so it is hashed again only if it changes.
+    The digests are also persisted in the `cache_dir`, if provided, which takes at most `disk_cache_size` bytes.
+    """
+
+    def __init__(self, algorithm, cache_dir: Optional[Path] = None, executor: Optional[Executor] = None,
+                 cache_size: Optional[int] = 2 ** 16, disk_cache_size: Optional[int] = None):
+        self.algorithm = algorithm
+        self._disk = None if cache_dir is None else DiskCache(cache_dir, disk_cache_size)
+        self._digests = LRUCache(cache_size)
+        self._executor, self._pid = executor, os.getpid()
+        self._lock = threading.Lock()
+
+    def digest(self, path: Path) -> str:
+        """ The hex digest of the file at `path` """
+        path = Path(path)
+        identity = _identity(path)
+        cached = self._digests.get(path)
+        if cached is None and self._disk is not None:
+            cached = self._disk.get(str(path))
+        if cached is not None and tuple(cached[0]) == identity:
+            self._digests.set(path, cached)
+            return cached[1]
+
+        digest = digest_value(path, self.algorithm).hex()
+        # the file might have changed while we were reading it
+        if _identity(path) == identity:
+            self._digests.set(path, (identity, digest))
+            if self._disk is not None:
+                self._disk.set(str(path), [identity, digest])
+        return digest
+
+    @property
+    def executor(self) -> Executor:
+        """ The worker pool for background verification """
+        with self._lock:
+            # the worker threads don't survive a fork
+            if self._executor is None or self._pid != os.getpid():
+                self._executor, self._pid = ThreadPoolExecutor(), os.getpid()
+            return self._executor
+
+
+def _identity(path: Path) -> Tuple[int, int, int, int]:
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
@@ -1,10 +1,12 @@
+import re
 from pathlib import Path
-from typing import AnyStr, Iterator, NamedTuple, Optional, Sequence, Tuple
+from typing import AnyStr, Callable, Iterator, NamedTuple, Optional, Sequence, Tuple
 
-from wcmatch.glob import Glob
+from wcmatch.glob import Glob, is_magic, translate
 
+from .cache import LRUCache
 from .exceptions import NameConflict
-from .hash import from_hash, is_hash, is_tree, load_key, load_tree, strip_tree, to_hash
+from .hash import CompactTree, from_hash, is_hash, is_tree, load_key, read_tree, strip_tree, to_hash
 from .vc import VC, TreeEntry
 
 
@@ -36,13 +38,19 @@ class BaseGlob(Glob):
 
 
 class BevGlob(BaseGlob):
-    def __init__(self, pattern, repo_root, relative, version, cache: dict, storage, fetch, flags: int):
+    def __init__(self, pattern, repo_root, relative, version, cache: dict, storage, fetch, flags: int,
+                 prefetch: Optional[Callable[[Sequence[str]], None]] = None, trees: Optional[LRUCache] = None):
         super().__init__(pattern, flags, Path(repo_root, relative))
         self._cache = cache
+        # the shared cache can evict entries at any moment, so everything this glob has seen is also kept here
+        self._seen = {}
+        # the normalized trees are content-addressed, so they can be shared between versions and calls
+        self._trees = trees
         self._version = version
         self._repo_root = Path(repo_root)
         self._storage = storage
         self._fetch = fetch
+        self._prefetch = prefetch
 
     def _list_dir(self, relative: Path) -> Sequence[Path]:
         """ Return the contents of a directory `relative` to `self._repo_root` """
@@ -58,19 +66,37 @@ class BevGlob(BaseGlob):
 
     def _get_cached(self, relative: Path):
         for parent in relative.parents:
-            if (self._version, parent) in self._cache:
-                cache = self._cache[self._version, parent]
+            cache = self._lookup(parent)
+            if cache is not None:
                 for part in relative.relative_to(parent).parts:
-                    assert part in cache, (part, relative)
+                    if not isinstance(cache, dict) or part not in cache:
+                        # no such path inside the hashed folder
+                        return None
                     cache = cache[part]
 
                 return cache
 
-        if (self._version, relative) in self._cache:
-            return self._cache[self._version, relative]
+        return self._lookup(relative)
+
+    def _lookup(self, relative: Path):
+        if relative not in self._seen:
+            value = self._cache.get((self._version, relative))
+            if value is None:
+                return None
+            self._seen[relative] = value
+        return self._seen[relative]
 
     def _set_cached(self, relative: Path, value):
-        self._cache[self._version, relative] = value
+        self._seen[relative] = self._cache[self._version, relative] = value
+
+    def _load_tree(self, key: str) -> dict:
+        key = strip_tree(key)
+        tree = None if self._trees is None else self._trees.get(key)
+        if tree is None:
+            tree = self._normalize_tree(read_tree(self._storage, key, self._fetch))
+            if self._trees is not None:
+                self._trees.set(key, tree)
+        return tree
 
     @staticmethod
     def _normalize_tree(raw: dict):
@@ -85,6 +111,28 @@ class BevGlob(BaseGlob):
 
         return tree
 
+    def scandir(self, relative: Path) -> Iterator[DirEntry]:
+        """ Return the contents of a directory `relative` to the glob's root """
+        self._load_owner(Path(self.root_dir, relative).relative_to(self._repo_root))
+        return self._scandir(str(relative) if relative.parts else None)
+
+    def _load_owner(self, relative: Path):
+        # unlike the glob, which descends from its root, the folder might lie deep inside a hashed folder
+        if self._get_cached(relative) is not None or self._exists(relative) or self._exists(to_hash(relative)):
+            return
+
+        for parent in list(reversed(relative.parents))[1:]:
+            key = self._read_tree_key(to_hash(parent))
+            if key is not None:
+                if is_tree(key):
+                    self._set_cached(parent, self._load_tree(key))
+                return
+
+    def get_key(self, relative: Path) -> Optional[str]:
+        """ The key of an already visited file `relative` to the glob's root, or None if the file is not hashed """
+        key = self._get_cached(Path(self.root_dir, relative).relative_to(self._repo_root))
+        return key if isinstance(key, str) else None
+
     def _lexists(self, path: AnyStr) -> bool:
         relative = Path(self.root_dir, path).relative_to(self._repo_root)
         return (
@@ -107,7 +155,7 @@ class BevGlob(BaseGlob):
                 assert not self._exists(relative), relative
                 assert is_tree(key), (key, relative)
 
-                cached = self._normalize_tree(self._storage.read(load_tree, strip_tree(key), fetch=self._fetch))
+                cached = self._load_tree(key)
                 self._set_cached(relative, cached)
 
         # is it a hashed folder?
@@ -118,7 +166,8 @@ class BevGlob(BaseGlob):
 
         else:
             # it's a real folder
-            for entry in self._list_dir(relative):
+            entries, keys = self._list_dir(relative), {}
+            for entry in entries:
                 relative_path = relative / entry.name
                 if is_hash(relative_path):
                     relative_plain = from_hash(relative_path)
@@ -127,11 +176,20 @@ class BevGlob(BaseGlob):
                             f'Both the path "{relative_plain}" and its hash "{relative_path}" found'
                         )
 
-                    key = self._read_tree_key(relative_path)
-                    assert key is not None, relative_path
+                    keys[relative_path] = self._read_tree_key(relative_path)
+                    assert keys[relative_path] is not None, relative_path
+
+            # the missing trees can be fetched all at once
+            if self._prefetch is not None:
+                self._prefetch([strip_tree(key) for key in keys.values() if is_tree(key)])
+
+            for entry in entries:
+                relative_path = relative / entry.name
+                if relative_path in keys:
+                    relative_plain, key = from_hash(relative_path), keys[relative_path]
                     is_dir = is_tree(key)
                     if is_dir:
-                        cached = self._normalize_tree(self._storage.read(load_tree, strip_tree(key), fetch=self._fetch))
+                        cached = self._load_tree(key)
                         self._set_cached(relative_plain, cached)
                     else:
                         self._set_cached(relative_plain, key)
@@ -143,8 +201,10 @@ class BevGlob(BaseGlob):
 
 
 class BevLocalGlob(BevGlob):
-    def __init__(self, pattern, repo_root, relative, storage, fetch, flags: int):
-        super().__init__(pattern, repo_root, relative, None, {}, storage, fetch, flags)
+    def __init__(self, pattern, repo_root, relative, storage, fetch, flags: int,
+                 prefetch: Optional[Callable[[Sequence[str]], None]] = None, trees: Optional[LRUCache] = None):
+        # the local hash files can change at any moment, so only the trees are cached between calls
+        super().__init__(pattern, repo_root, relative, None, {}, storage, fetch, flags, prefetch, trees)
 
     def _list_dir(self, relative: Path):
         return [
@@ -162,15 +222,62 @@ class BevLocalGlob(BevGlob):
 
 
 class BevVCGlob(BevGlob):
-    def __init__(self, pattern, repo_root, relative, version, cache, vc: VC, storage, fetch, flags: int):
-        super().__init__(pattern, repo_root, relative, version, cache, storage, fetch, flags)
+    def __init__(self, pattern, repo_root, relative, version, cache, vc: VC, storage, fetch, flags: int,
+                 prefetch: Optional[Callable[[Sequence[str]], None]] = None, trees: Optional[LRUCache] = None):
+        super().__init__(pattern, repo_root, relative, version, cache, storage, fetch, flags, prefetch, trees)
         self._vc = vc
 
     def _list_dir(self, relative: Path):
         return self._vc.list_dir(str(relative), self._version)
 
     def _exists(self, relative: Path):
-        return relative.name in {x.name for x in self._vc.list_dir(str(relative.parent), self._version)}
+        return self._vc.exists(str(relative), self._version)
 
     def _read_tree_key(self, relative: Path):
         return self._vc.read(str(relative), self._version)
+
+
+def glob_tree(tree: CompactTree, pattern: str, flags: int, root: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Match the `pattern` directly against the sorted paths of a flat `tree`, without building the nested folders.
+    The tree is located in the folder `root`, relative to which the `pattern` is defined.
+    Only the entries under the pattern's literal prefix are visited.
+
+    Yields the matched paths relative to `root`'s parent and their keys, which are None for folders.
+    """
+    include, exclude = translate(pattern, flags=flags)
+    include, exclude = [re.compile(x) for x in include], [re.compile(x) for x in exclude]
+
+    def matches(path):
+        return any(x.match(path) for x in include) and not any(x.match(path) for x in exclude)
+
+    *folders, _ = pattern.split('/')
+    literal = []
+    for part in folders:
+        if not part or is_magic(part, flags=flags):
+            break
+        literal.append(part)
+    if not literal or literal[0] != root:
+        return
+
+    # the folders are implied by the paths, so each of them is checked once, before its contents
+    folder = '/'.join(literal)
+    inner = folder[len(root) + 1:] or '.'
+    if (inner == '.' or tree.is_folder(inner)) and matches(folder + '/'):
+        yield folder, None
+
+    # a trailing slash matches only folders
+    files = not pattern.endswith('/')
+    seen = set()
+    for path, key in tree.iter_folder(inner):
+        parts = [root, *path.split('/')]
+        for idx in range(len(literal) + 1, len(parts)):
+            parent = '/'.join(parts[:idx])
+            if parent not in seen:
+                seen.add(parent)
+                if matches(parent + '/'):
+                    yield parent, None
+
+        path = '/'.join(parts)
+        if files and matches(path):
+            yield path, key
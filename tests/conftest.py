@@ -13,6 +13,13 @@ from bev.testing import create_structure
 from tarn.config import init_storage, StorageConfig
 
 
+@pytest.fixture(autouse=True)
+def user_cache(tmp_path, monkeypatch):
+    # keep the persistent caches away from the real home folder
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'user-cache'))
+    return tmp_path / 'user-cache' / 'bev'
+
+
 @pytest.fixture
 def tests_root():
     return Path(__file__).parent
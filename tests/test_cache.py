@@ -0,0 +1,54 @@
+import os
+
+from bev.cache import DiskCache, LRUCache, _disk_usage, tree_footprint
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # `b` is the least recently used
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.get('b', 'default') == 'default'
+    assert cache.info() == (1, 1, 2, 2)
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.info() == (0, 0, 0, 0)
+
+
+def test_weighted_cache():
+    small, large = {'a': '0' * 64}, {str(i): '0' * 64 for i in range(100)}
+    assert tree_footprint(small) < tree_footprint(large)
+
+    cache = LRUCache(tree_footprint(large), tree_footprint)
+    cache.set('small', small)
+    cache.set('large', large)
+    assert 'small' not in cache and 'large' in cache
+    assert cache.info().weight == tree_footprint(large)
+
+    # values that don't fit are not cached at all
+    cache = LRUCache(tree_footprint(small), tree_footprint)
+    cache.set('large', large)
+    assert len(cache) == 0
+
+
+def test_disk_cache_cleanup(tmp_path):
+    cache = DiskCache(tmp_path)
+    for i in range(20):
+        cache.set(str(i), i)
+        os.utime(cache._path(str(i)), (i, i))
+
+    usage = _disk_usage(os.stat(cache._path('0')))
+    cache = DiskCache(tmp_path, max_size=10 * usage)
+    # reading an entry makes it the most recently used one
+    assert cache.get('0') == 0
+    cache.cleanup()
+    assert [i for i in range(20) if cache.get(str(i)) is not None] == [0, 14, 15, 16, 17, 18, 19]
+
+    # the writes trigger the cleanup as well
+    for i in range(20, 40):
+        cache.set(str(i), i)
+    assert sum(cache.get(str(i)) is not None for i in range(40)) <= 10
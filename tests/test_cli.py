@@ -1,6 +1,8 @@
 import grp
 import os
+import re
 import shutil
+import subprocess
 from pathlib import Path
 
 import pytest
@@ -157,3 +159,40 @@ meta:
                 storage_config = load_storage_config(folder)
                 assert storage_config.hash == config.meta.hash
                 assert tuple(storage_config.levels) == (1, 31)
+
+
+@pytest.mark.parametrize('bisect', [False, True])
+def test_blame(temp_repo, chdir, bisect):
+    def commit(author, **files):
+        create_structure(temp_repo / 'folder', files)
+        result = runner.invoke(app, ['add', 'folder', '--conflict', 'override'])
+        assert result.exit_code == 0, result.output
+        subprocess.check_call(['git', 'add', '.'], cwd=temp_repo)
+        subprocess.check_call(
+            ['git', 'commit', '-m', author], cwd=temp_repo, env={**os.environ, 'GIT_AUTHOR_NAME': author}
+        )
+
+    subprocess.check_call(['git', 'init'], cwd=temp_repo)
+    with chdir(temp_repo):
+        commit('first', a='1')
+        commit('second', b='1')
+        commit('third', a='2')
+        commit('fourth', c='1')
+        commit('fifth', b='2')
+
+        for relative, author in [('a', 'third'), ('b', 'fifth'), ('c', 'fourth')]:
+            args = ['blame', 'folder.hash', relative]
+            if bisect:
+                args.append('--bisect')
+            result = runner.invoke(app, args)
+            assert result.exit_code == 0, result.output
+            assert re.findall(r'(\w+) <', result.output) == [author], result.output
+
+        # the value is inside a folder, which doesn't have its own hash
+        commit('sixth', **{'nested/d': '1'})
+        args = ['blame', 'folder/nested', 'd']
+        if bisect:
+            args.append('--bisect')
+        result = runner.invoke(app, args)
+        assert result.exit_code == 255
+        assert 'folder/nested.hash" has no history' in result.output
@@ -3,7 +3,8 @@ from unittest import mock
 import pytest
 from yaml import safe_load
 
-from bev.config import parse, load_config
+from bev import Repository
+from bev.config import CONFIG, load_config, load_repository, parse
 from bev.config.parse import _parse
 from bev.exceptions import ConfigError
 
@@ -80,3 +81,28 @@ def test_custom_cache_storage(configs_root):
 
     config = load_config(configs_root / 'full.yml')
     assert config.local.cache.storage == config.local.storage
+
+
+def test_load_repository(temp_repo):
+    first = load_repository(temp_repo)
+    assert load_repository(temp_repo) is first
+    assert Repository(temp_repo).storage is Repository(temp_repo).storage is first.storage
+
+    # any change to the config invalidates the cache
+    with open(temp_repo / CONFIG, 'a') as file:
+        file.write('\nmeta: {tree_format: binary}\n')
+    second = load_repository(temp_repo)
+    assert second is not first
+    assert second.config.meta.tree_format == 'binary'
+    assert load_repository(temp_repo) is second
+
+    # so does a missing optional include that appears later
+    config = (temp_repo / CONFIG).read_text()
+    (temp_repo / CONFIG).write_text(config.replace('binary}', 'binary, include: [{file: extra.yml, optional: true}]}'))
+    third = load_repository(temp_repo)
+    assert load_repository(temp_repo) is third
+    assert not third.config.meta.nested_trees
+    (temp_repo / 'extra.yml').write_text('meta: {nested_trees: true}\n')
+    fourth = load_repository(temp_repo)
+    assert fourth is not third
+    assert fourth.config.meta.nested_trees
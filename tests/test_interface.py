@@ -1,15 +1,33 @@
+import asyncio
 import os
+import pickle
 import shutil
+import subprocess
+import types
 from pathlib import Path
 
 import pytest
 
+import bev.config.utils
+import bev.interface
+import bev.vc
+import bev.verify
 from bev import Local, Repository
-from bev.exceptions import InconsistentHash, HashNotFound
+from bev.cache import tree_footprint
+from bev.config import find_repo_configs
+from bev.exceptions import ConfigError, InconsistentHash, HashNotFound
+from bev.hash import HashIndex
+from bev.native import NativeGit
+from bev.ops import save_hash
 from bev.testing import create_structure
+from bev.vc import CatFileGit, SubprocessGit
+from tarn import DiskDict, HashKeyStorage
+from tarn.config import StorageConfig, init_storage
+from wcmatch.glob import DOTGLOB, GLOBSTAR
 
 
-def test_glob(git_repository):
+@pytest.mark.parametrize('vc', [SubprocessGit, CatFileGit, NativeGit])
+def test_glob(git_repository, vc):
     def check(version, expected, pattern=None):
         expected = set(map(Path, expected))
         # add folders
@@ -20,7 +38,7 @@ def test_glob(git_repository):
             pattern = '**/*'
         assert set(repo.glob(pattern, version=version)) == expected
 
-    repo = Repository(git_repository / 'bev-repo')
+    repo = Repository(git_repository / 'bev-repo', vc=vc)
     # all content
     check('v1', [
         'just-a-file.txt',
@@ -88,7 +106,7 @@ def test_glob(git_repository):
     ], '**/*.txt')
 
     # now the same but with nesting
-    repo = Repository(git_repository / 'bev-repo') / 'folder'
+    repo = Repository(git_repository / 'bev-repo', vc=vc) / 'folder'
     # all content
     check('v1', [
         'file.txt',
@@ -134,8 +152,147 @@ def test_glob(git_repository):
     ], '**/*.txt')
 
 
-def test_resolve(git_repository):
+@pytest.mark.parametrize('version', ['v4', Local])
+def test_lazy_glob(git_repository, version):
+    repo = Repository(git_repository / 'bev-repo', version=version)
+    key = repo.get_key('folder/nested/a.npy')
+    assert isinstance(repo.iglob('**/*.npy'), types.GeneratorType)
+    assert sorted(repo.iglob('**/*.npy')) == sorted(repo.glob('**/*.npy'))
+    assert sorted(repo.iglob('folder/**/*.npy', keys=True)) == [
+        (Path('folder/nested/a.npy'), key), (Path('folder/nested/b.npy'), key), (Path('folder/nested/c.npy'), key),
+    ]
+
+    assert sorted(repo.iterdir('folder', keys=True)) == [(Path('folder/file.txt'), key), (Path('folder/nested'), None)]
+    assert Path('.bev.yml') in set(repo.iterdir())
+
+    walk = {folder: (sorted(folders), files) for folder, folders, files in repo.walk(keys=True)}
+    assert walk[Path('folder')] == (['nested'], {'file.txt': key})
+    assert walk[Path('folder/nested')] == ([], {'a.npy': key, 'b.npy': key, 'c.npy': key})
+    assert walk[Path('images')] == ([], {'one.png': None, 'two.png': None})
+
+    # starting inside a hashed folder
+    assert list(repo.walk('folder/nested', keys=True)) == [
+        (Path('folder/nested'), [], {'a.npy': key, 'b.npy': key, 'c.npy': key}),
+    ]
+    assert list((repo / 'folder').walk('nested')) == [(Path('nested'), [], ['a.npy', 'b.npy', 'c.npy'])]
+
+    # pruning
+    for folder, folders, _ in (repo / 'folder').walk():
+        assert folder == Path('.')
+        folders.clear()
+
+
+def test_glob_cache_eviction(git_repository, temp_dir, monkeypatch):
+    shutil.copytree(git_repository, temp_dir / 'repo')
+    root = temp_dir / 'repo' / 'bev-repo'
+    key = Repository(root).get_key('folder/nested/a.npy', version='v4')
+    for i in range(5):
+        (root / f'many/{i}.npy.hash').parent.mkdir(exist_ok=True)
+        (root / f'many/{i}.npy.hash').write_text(key)
+    subprocess.check_call(['git', 'add', '.'], cwd=root)
+    subprocess.check_call(['git', 'commit', '-q', '-m', 'many'], cwd=root)
+
+    # more hashed entries than the glob cache can hold
+    monkeypatch.setattr(Repository, 'glob_cache_size', 2)
+    repo = Repository(root, version='HEAD')
+    expected = {Path(f'many/{i}.npy'): key for i in range(5)}
+    assert dict(repo.iglob('many/*', keys=True)) == expected
+    assert dict(repo.iglob('**/*.npy', keys=True)) == {
+        **expected, **{Path(f'folder/nested/{x}.npy'): key for x in 'abc'},
+    }
+    walk = {folder: files for folder, _, files in repo.walk(keys=True)}
+    assert walk[Path('many')] == {f'{i}.npy': key for i in range(5)}
+    assert walk[Path('folder/nested')] == {f'{x}.npy': key for x in 'abc'}
+
+
+def test_glob_tree(git_repository, temp_repo, tests_root):
+    def check(repo, version, patterns):
+        for flags in [GLOBSTAR, GLOBSTAR | DOTGLOB]:
+            for pattern in patterns:
+                # the literal prefix is inside a hashed folder, so the flat engine is used
+                assert repo._glob_tree(pattern, repo._resolve_version(version), False, flags) is not None
+                glob = repo._make_glob(pattern, version, False, flags)
+                expected = {repo._with_key(glob, Path(match), True) for match in glob.glob()}
+                assert set(repo._iglob(pattern, version, False, flags, True)) == expected, (pattern, flags)
+
+    patterns = [
+        'folder/*', 'folder/**', 'folder/**/*', 'folder/**/', 'folder/*/', 'folder/n*/*', 'folder/**/*.npy',
+        'folder/nested', 'folder/nested/', 'folder/nested/**', 'folder/nested/a.npy', 'folder/nested/a.npy/*',
+        'folder/missing/*', 'folder/[fn]*', 'folder/**/a.npy', 'folder/**/nested/*',
+    ]
     repo = Repository(git_repository / 'bev-repo')
+    for version in ['v4', Local]:
+        check(repo, version, patterns)
+        check(repo / 'folder', version, [pattern[7:] for pattern in patterns])
+    check(repo, 'v3', ['folder/nested/', 'folder/nested/**', 'folder/nested/*'])
+
+    # hidden files and folders
+    repo = Repository(temp_repo, version=Local)
+    key = repo.storage.write(tests_root / 'conftest.py').hex()
+    save_hash({
+        'a.txt': key, '.b.txt': key, 'c/.d.txt': key, 'c/e/f.txt': key, '.g/h.txt': key, '.g/.i/j.txt': key,
+    }, temp_repo / 'data.hash', repo)
+    check(repo, Local, [
+        'data/*', 'data/**', 'data/**/*', 'data/**/', 'data/*/', 'data/**/*.txt', 'data/.*', 'data/.g/*',
+        'data/.g/**', 'data/c/**/*', 'data/**/.*', 'data/*/*.txt',
+    ])
+
+
+def test_single_read(git_repository, monkeypatch):
+    repo = Repository(git_repository / 'bev-repo', version='v4')
+    path = repo.resolve('folder/nested/a.npy')
+    reads = []
+    read = repo.storage.read
+    monkeypatch.setattr(repo.storage, 'read', lambda *args, **kwargs: reads.append(args) or read(*args, **kwargs))
+    # the key is present locally, so the storage is read only once
+    assert repo.resolve('folder/nested/b.npy') == path
+    assert len(reads) == 1
+
+
+def test_caches(git_repository):
+    repo = Repository(git_repository / 'bev-repo', version='v4')
+    assert repo.get_key('folder/nested/a.npy') == repo.get_key('folder/nested/a.npy')
+    info = repo.cache_info()['trees']
+    assert (info.hits, info.misses, info.size) == (1, 1, 1)
+    assert info.weight > 0
+
+    repo.clear_caches()
+    assert repo.cache_info()['trees'] == (0, 0, 0, 0)
+
+    # the local trees are cached as well
+    assert repo.get_key('folder/nested/a.npy', version=Local) == repo.get_key('folder/nested/a.npy', version=Local)
+    assert repo.cache_info()['trees'][:3] == (1, 1, 1)
+    repo.clear_caches()
+
+    repo = Repository(git_repository / 'bev-repo', version='v4', tree_cache_size=0)
+    repo.get_key('folder/nested/a.npy')
+    assert repo.cache_info()['trees'].size == 0
+
+    # the normalized trees are reused between local globs
+    repo = Repository(git_repository / 'bev-repo', version=Local)
+    assert repo.glob('**/*.npy') == repo.glob('**/*.npy')
+    assert repo.cache_info()['glob_trees'][:3] == (1, 1, 1)
+    # and shared with the committed version with the same tree
+    repo.glob('**/*.npy', version='v4')
+    assert repo.cache_info()['glob_trees'][:3] == (2, 1, 1)
+    # weighed by their size
+    tree, = [value for value, _ in repo._glob_trees._values.values()]
+    assert repo.cache_info()['glob_trees'].weight == tree_footprint(tree) > tree_footprint({'nested': {}})
+
+
+def test_children(git_repository, monkeypatch):
+    repo = Repository(git_repository / 'bev-repo', version='v4')
+    monkeypatch.setattr(bev.interface, 'load_repository', None)
+    child = repo / 'folder' / 'nested'
+    assert child.path == repo.root / 'folder/nested'
+    assert (child.storage, child.vc, child._trees) == (repo.storage, repo.vc, repo._trees)
+    assert child.get_key('a.npy') == repo.get_key('folder/nested/a.npy')
+    assert repo.prefix == Path()
+
+
+@pytest.mark.parametrize('vc', [SubprocessGit, CatFileGit, NativeGit])
+def test_resolve(git_repository, vc):
+    repo = Repository(git_repository / 'bev-repo', vc=vc)
     storage = repo.storage._local._levels[0].location._locations[0].root
     for local in [
         'just-a-file.txt',
@@ -171,6 +328,191 @@ def test_resolve(git_repository):
         repo.resolve('folder/nested', version='v3')
 
 
+def test_verified_digests(temp_repo, monkeypatch, user_cache):
+    repo = Repository(temp_repo, version=Local, check=True)
+    create_structure(temp_repo, ['a.txt', 'b.txt'])
+    (temp_repo / 'b.txt').write_text('b')
+    keys = {name: repo.storage.write(temp_repo / name).hex() for name in ['a.txt', 'b.txt']}
+    for name, key in keys.items():
+        (temp_repo / name).unlink()
+        (temp_repo / f'{name}.hash').write_text(key)
+
+    digests = []
+    digest_value = bev.verify.digest_value
+    monkeypatch.setattr(bev.verify, 'digest_value', lambda *args: digests.append(args[0]) or digest_value(*args))
+
+    path = repo.resolve('a.txt')
+    assert repo.resolve('a.txt') == repo.resolve_many(['a.txt'])[0] == path
+    assert len(digests) == 1
+    # the digests are persisted in the user's cache only on demand
+    assert not (user_cache / 'digests').exists()
+    assert Repository(temp_repo, version=Local, check=True, disk_cache=True).resolve('a.txt') == path
+    assert len(digests) == 2
+    assert list((user_cache / 'digests').glob('*/*'))
+    assert Repository(temp_repo, version=Local, check=True, disk_cache=True).resolve('a.txt') == path
+    assert len(digests) == 2
+
+    futures = repo.verify(['a.txt', 'b.txt', 'missing.txt'])
+    assert [f.result() for f in futures[:2]] == [path, repo.resolve('b.txt', check=False)]
+    with pytest.raises(HashNotFound):
+        futures[2].result()
+    assert len(digests) == 3
+
+    # a changed file is hashed again
+    path.chmod(0o644)
+    path.write_text('corrupted')
+    with pytest.raises(InconsistentHash):
+        repo.resolve('a.txt')
+    with pytest.raises(InconsistentHash):
+        repo.verify(['a.txt'])[0].result()
+
+
+def test_pickle(git_repository, temp_repo, user_cache):
+    repo = Repository(git_repository / 'bev-repo', version='v4') / 'folder'
+    repo.get_key('nested/a.npy')
+    # the images are opt-in
+    assert not (user_cache / 'trees').exists()
+    restored = pickle.loads(pickle.dumps(repo))
+    assert restored.path == repo.path
+    assert restored.version == repo.vc.resolve_version('v4')
+    assert restored.get_key('nested/a.npy') == repo.get_key('nested/a.npy')
+
+    # the trees are memory-mapped from their binary images in the user's cache
+    h, relative = repo._split(Path('folder/nested/a.npy'), restored.version)
+    assert restored._get_tree(h, False).is_mapped
+    assert pickle.loads(pickle.dumps(repo))._get_tree(h, False).is_mapped
+    images = list((user_cache / 'trees').glob('*/*'))
+    assert images
+    # the images are as accessible as their folder
+    assert all(x.stat().st_mode & 0o666 == x.parent.stat().st_mode & 0o666 for x in images)
+
+    repo = Repository(temp_repo, version=Local)
+    restored = pickle.loads(pickle.dumps(repo))
+    assert restored.version == Local
+
+    repo = Repository(temp_repo)
+    data = pickle.dumps(repo)
+    with open(temp_repo / '.bev.yml', 'a') as file:
+        file.write('\n# a comment\n')
+    with pytest.raises(ConfigError):
+        pickle.loads(data)
+
+
+def test_hash_index(git_repository, monkeypatch):
+    index = HashIndex(['a/b.hash', 'a/b/c/d.hash', 'e.hash'])
+    assert index.find('a/b/c/d/f') == Path('a/b')
+    assert index.find('a/b') == Path('a/b')
+    assert index.find('e/f/g') == Path('e')
+    assert index.find('a') is None
+    assert index.find('a/c') is None
+    assert index.find('.') is None
+
+    repo = Repository(git_repository / 'bev-repo', version='v3')
+    reads = []
+    read = repo.vc.read
+    monkeypatch.setattr(repo.vc, 'read', lambda relative, version: reads.append(relative) or read(relative, version))
+    # only the owning hash is read
+    assert repo.get_key('folder/nested/a.npy') == repo.get_key('folder/nested/a.npy', version=Local)
+    assert reads == ['folder/nested.hash']
+    assert repo.get_key('folder/missing/file', error=False) is None
+    assert reads == ['folder/nested.hash']
+
+
+@pytest.mark.parametrize('vc', [SubprocessGit, CatFileGit, NativeGit])
+def test_async(git_repository, vc, monkeypatch):
+    async def main():
+        keys = await asyncio.gather(*(repo.aget_key(path, version='v4', error=False) for path in paths))
+        resolved = await asyncio.gather(*(repo.aresolve(path, version='v2', check=True) for path in existing))
+        trees = await asyncio.gather(*(repo.aload_tree('folder.hash', version='v4') for _ in range(2)))
+        globs = await asyncio.gather(repo.aglob('**/*', version='v3'), repo.aglob('**/*', version=Local))
+        with pytest.raises(HashNotFound):
+            await repo.aget_key('folder/nested', version='v3')
+        return keys, resolved, trees, globs
+
+    def count(func):
+        async def wrapper(command, cwd):
+            calls.append(command)
+            return await func(command, cwd)
+
+        return wrapper
+
+    calls = []
+    monkeypatch.setattr(bev.vc, 'call_git_async', count(bev.vc.call_git_async))
+    paths = ['folder/file.txt', 'folder/nested/a.npy', 'folder/nested/b.npy', 'folder/missing.txt'] * 10
+    existing = ['another.file', 'folder/nested/a.npy'] * 10
+
+    sync = Repository(git_repository / 'bev-repo', vc=vc)
+    repo = Repository(git_repository / 'bev-repo', vc=vc)
+    # `asyncio.run` is not available in python 3.6
+    loop = asyncio.new_event_loop()
+    try:
+        keys, resolved, trees, globs = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert keys == [sync.get_key(path, version='v4', error=False) for path in paths]
+    assert resolved == [sync.resolve(path, version='v2') for path in existing]
+    assert trees == [sync.load_tree('folder.hash', version='v4')] * 2
+    assert globs == [sync.glob('**/*', version='v3'), sync.glob('**/*', version=Local)]
+    # concurrent requests share the git calls
+    assert len(calls) == len(set(calls))
+
+
+def test_resolve_many(git_repository, temp_dir):
+    repo = Repository(git_repository / 'bev-repo')
+    paths = [
+        'folder/nested/a.npy', 'another.file', 'folder/nested', 'folder/missing', 'missing', 'folder/nested/b.npy',
+        'just-a-file.txt',
+    ]
+    for version in ['v2', 'v3', 'v4', Local]:
+        result = repo.resolve_many(paths, version=version)
+        assert len(result) == len(paths)
+        for path, value in zip(paths, result):
+            try:
+                expected = repo.resolve(path, version=version)
+            except Exception as e:
+                assert type(value) is type(e), (path, version)
+            else:
+                assert value == expected, (path, version)
+
+    # all the missing files are fetched in a single batch
+    init_storage(StorageConfig(hash='sha256', levels=[1, 31]), temp_dir / 'storage')
+    repo.storage = HashKeyStorage(DiskDict(temp_dir / 'storage'), remote=repo.storage._local)
+    fetched = []
+    fetch = repo.storage.fetch
+    repo.storage.fetch = lambda keys: fetched.append(keys) or fetch(keys)
+
+    paths = ['folder/nested/a.npy', 'folder/nested/b.npy', 'folder/file.txt', 'folder/missing']
+    result = repo.resolve_many(paths, version='v4', fetch=False)
+    assert all(isinstance(x, Exception) for x in result)
+    assert fetched == []
+
+    result = repo.resolve_many(paths, version='v4')
+    assert [is_relative_to(x, temp_dir) for x in result[:-1]] == [True] * 3
+    assert isinstance(result[-1], HashNotFound)
+    # one batch for the tree, one for the files
+    assert len(fetched) == 2
+
+    # same for a parallel fetch
+    init_storage(StorageConfig(hash='sha256', levels=[1, 31]), temp_dir / 'parallel')
+    repo = Repository(git_repository / 'bev-repo', max_workers=4)
+    repo.storage = HashKeyStorage(DiskDict(temp_dir / 'parallel'), remote=repo.storage._local)
+    assert repo.resolve_many(paths, version='v4')[:-1] == [repo.resolve(path, version='v4') for path in paths[:-1]]
+    assert repo.glob('folder/**/*', version='v4', fetch=True)
+
+
+def test_latest_versions(git_repository):
+    repo = Repository(git_repository / 'bev-repo')
+    paths = ['.', 'folder', 'folder/nested', 'another.file', 'images/one.png', 'missing']
+    expected = [repo.vc.get_version(str(x)) for x in [
+        '.', 'folder.hash', 'folder/nested.hash', 'another.file.hash', 'images/one.png', 'missing.hash',
+    ]]
+    assert expected[-1] is None
+    assert repo.latest_versions(paths, default=None) == expected
+    assert [repo.latest_version(x, default=None) for x in paths] == expected
+    with pytest.raises(FileNotFoundError):
+        repo.latest_versions(paths)
+
+
 def test_from_here(temp_repo_factory):
     root = Path(__file__).resolve().parent.parent / 'some-repo'
     root.mkdir()
@@ -182,6 +524,39 @@ def test_from_here(temp_repo_factory):
             shutil.rmtree(root)
 
 
+@pytest.mark.parametrize('git', [True, False])
+def test_from_vcs(git_repository, chdir, monkeypatch, git):
+    if not git:
+        def call_git(*args, **kwargs):
+            raise FileNotFoundError('git')
+
+        monkeypatch.setattr(bev.config.utils, 'call_git', call_git)
+
+    expected = [git_repository / 'bev-repo/.bev.yml']
+    assert find_repo_configs(git_repository) == expected
+    with chdir(git_repository / 'bev-repo/images'):
+        assert Repository.from_vcs().root == git_repository / 'bev-repo'
+
+    # nested repositories are not traversed
+    nested = git_repository / 'nested'
+    nested.mkdir()
+    subprocess.call(['git', 'init'], cwd=nested)
+    (nested / '.bev.yml').touch()
+    try:
+        assert find_repo_configs(git_repository) == expected
+    finally:
+        shutil.rmtree(nested)
+
+
+def test_from_vcs_deleted_config(git_repository, temp_dir):
+    repo = temp_dir / 'repo'
+    shutil.copytree(git_repository, repo)
+    assert find_repo_configs(repo) == [repo / 'bev-repo/.bev.yml']
+    # the deletion is not committed
+    (repo / 'bev-repo/.bev.yml').unlink()
+    assert find_repo_configs(repo) == []
+
+
 def test_class_defaults(temp_repo):
     repo = Repository(temp_repo, version=Local)
     create_structure(temp_repo, {'4.png.hash': repo.storage.write(__file__).hex()})
@@ -1,8 +1,26 @@
+import hashlib
+import json
+import pickle
+import sys
+import tempfile
+
 import pytest
 
-from bev import Repository
-from bev.hash import tree_to_hash
-from bev.ops import gather
+from bev import Local, Repository
+from bev.cache import tree_footprint
+from bev.exceptions import HashNotFound
+from bev.hash import (
+    CompactTree,
+    get_from_tree,
+    is_tree,
+    load_key,
+    load_tree,
+    read_tree,
+    strip_tree,
+    tree_to_hash,
+    update_tree,
+)
+from bev.ops import gather, load_hash, save_hash
 from bev.testing import create_structure
 
 
@@ -75,3 +93,113 @@ def test_gather_nested_hash(tmpdir, temp_repo, tests_root, sha256empty):
 def test_gather_missing():
     with pytest.raises(FileNotFoundError):
         gather('/tmp/missing', None)
+
+
+def test_compact_tree():
+    raw = {f'folder/{i % 7}/file-{i}.npy': hashlib.sha256(str(i).encode()).hexdigest() for i in range(1000)}
+    raw['a/b/c'] = hashlib.sha256().hexdigest()
+    tree = CompactTree(raw)
+
+    assert tree == raw
+    assert list(tree) == sorted(raw)
+    assert list(tree.items()) == sorted(raw.items())
+    assert sorted(tree.values()) == sorted(raw.values())
+    assert tree['a/b/c'] == raw['a/b/c']
+    assert all(tree[path] == value for path, value in raw.items())
+    assert tree.get('folder/3') is None and tree.get('folder/3/file-3.npy/') is None
+    assert tree.digest('a/b/c') == bytes.fromhex(raw['a/b/c'])
+    assert tree.get('a/b') is None
+    assert 'missing' not in tree and 'a/b/c' in tree
+    assert tree.is_folder('a') and tree.is_folder('a/b') and tree.is_folder('folder/3')
+    assert not tree.is_folder('a/b/c') and not tree.is_folder('folder/3/file')
+    assert pickle.loads(pickle.dumps(tree)) == tree
+    assert sys.getsizeof(tree) * 3 < tree_footprint(raw)
+
+    assert len(CompactTree({})) == 0
+    with pytest.raises(ValueError):
+        CompactTree({'a': '00', 'b': '0000'})
+
+
+def test_binary_tree(temp_repo, tests_root):
+    with open(temp_repo / '.bev.yml', 'a') as file:
+        file.write('\nmeta: {tree_format: binary}\n')
+
+    repo = Repository(temp_repo, version=Local)
+    assert repo.tree_format == 'binary'
+    storage = repo.storage
+    hash_a = storage.write(tests_root / 'conftest.py').hex()
+    hash_b = storage.write(tests_root / 'test_ops.py').hex()
+    tree = {'a/b.txt': hash_a, 'a/c/d.txt': hash_b, 'e.txt': hash_a}
+
+    save_hash(tree, temp_repo / 'binary.hash', repo)
+    save_hash(tree, temp_repo / 'json.hash', storage)
+    binary, json = load_key(temp_repo / 'binary.hash'), load_key(temp_repo / 'json.hash')
+    assert binary != json
+    assert storage.read(lambda path: path.read_bytes()[:7], strip_tree(binary)) == b'BEVTREE'
+    assert storage.read(lambda path: path.read_bytes()[:1], strip_tree(json)) == b'{'
+
+    assert load_hash(temp_repo / 'binary.hash', storage) == load_hash(temp_repo / 'json.hash', storage) == tree
+    for name in ['binary', 'json']:
+        assert repo.get_key(name, 'a/c/d.txt') == hash_b
+        assert repo.load_tree(f'{name}.hash') == tree
+
+    with pytest.raises(ValueError):
+        tree_to_hash(tree, storage, 'xml')
+
+
+@pytest.mark.parametrize('tree_format', ['json', 'binary'])
+def test_nested_tree(temp_repo, tests_root, tree_format, monkeypatch):
+    with open(temp_repo / '.bev.yml', 'a') as file:
+        file.write(f'\nmeta: {{tree_format: {tree_format}, nested_trees: true}}\n')
+
+    repo = Repository(temp_repo, version=Local)
+    assert repo.nested_trees
+    storage = repo.storage
+    hash_a = storage.write(tests_root / 'conftest.py').hex()
+    hash_b = storage.write(tests_root / 'test_ops.py').hex()
+    tree = {'a/b.txt': hash_a, 'a/c/d.txt': hash_b, 'e.txt': hash_a}
+
+    save_hash(tree, temp_repo / 'nested.hash', repo)
+    key = load_key(temp_repo / 'nested.hash')
+    top = storage.read(load_tree, strip_tree(key))
+    assert set(top) == {'a', 'e.txt'}
+    assert is_tree(top['a'])
+
+    assert read_tree(storage, key) == load_hash(temp_repo / 'nested.hash', storage) == tree
+    assert repo.load_tree('nested.hash') == tree
+    assert repo.get_key('nested', 'a/c/d.txt') == hash_b
+    assert repo.get_key('nested', 'a/missing.txt', error=False) is None
+    for folder in ['a', 'a/c']:
+        with pytest.raises(HashNotFound, match='is a folder'):
+            repo.get_key('nested', folder)
+
+    # only the subtrees on the changed path are rewritten
+    updated = update_tree(key, {'a/c/f.txt': hash_a}, storage, tree_format)
+    assert read_tree(storage, updated) == {**tree, 'a/c/f.txt': hash_a}
+    new = storage.read(load_tree, strip_tree(updated))
+    assert new['a'] != top['a']
+    assert new['e.txt'] == top['e.txt']
+
+    # the loaded subtrees are shared between calls
+    trees = {}
+    assert get_from_tree(storage, key, 'a/c/d.txt', trees=trees) == hash_b
+    assert len(trees) == 3
+    monkeypatch.setattr(storage, 'read', None)
+    assert get_from_tree(storage, key, 'a/b.txt', trees=trees) == hash_a
+    assert get_from_tree(storage, key, 'a/c/missing.txt', trees=trees) is None
+
+    with pytest.raises(ValueError):
+        tree_to_hash({'a': hash_a, 'a/b': hash_b}, storage, tree_format, nested=True)
+
+
+def test_tree_in_memory(temp_repo, tests_root, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('No temporary files are expected')
+
+    monkeypatch.setattr(tempfile, 'TemporaryDirectory', fail)
+    storage = Repository(temp_repo).storage
+    key = storage.write(tests_root / 'conftest.py').hex()
+    tree = {'b.txt': key, 'a/c.txt': key}
+    # the same key as for the file written by `json.dump`
+    expected = hashlib.sha256(json.dumps({'a/c.txt': key, 'b.txt': key}).encode('utf-8')).hexdigest()
+    assert tree_to_hash(tree, storage) == 'T:' + expected
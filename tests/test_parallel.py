@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bev.aio import IO, arun_io, run_io
+from bev.parallel import Fetcher
+
+
+class SlowStorage:
+    def __init__(self):
+        self.requests = []
+        self.active = self.max_active = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, keys):
+        with self._lock:
+            self.requests.extend(keys)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.1)
+        with self._lock:
+            self.active -= 1
+        return [(key, key != b'missing') for key in keys]
+
+
+def test_fetcher():
+    keys = [bytes([i]) for i in range(100)] + [b'missing']
+    storage = SlowStorage()
+    with ThreadPoolExecutor(8) as executor:
+        fetcher = Fetcher(executor, chunk_size=10)
+        result = fetcher.fetch(storage, keys)
+        # 11 chunks in 8 threads and the calling one
+        assert 1 < storage.max_active <= 9
+        assert result == {key: key != b'missing' for key in keys}
+
+    # fetching from a busy worker of the same pool doesn't wait for the pool
+    storage = SlowStorage()
+    with ThreadPoolExecutor(1) as executor:
+        fetcher = Fetcher(executor, chunk_size=10)
+        result = executor.submit(fetcher.fetch, storage, keys).result(timeout=10)
+        assert result == {key: key != b'missing' for key in keys}
+
+    # concurrent requests for the same keys share the fetch
+    storage, fetcher = SlowStorage(), Fetcher()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fetcher.fetch(storage, keys))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(storage.requests) == sorted(keys)
+    assert results == [{key: key != b'missing' for key in keys}] * 4
+
+
+def test_run_io():
+    def fail(value):
+        raise ValueError(value)
+
+    async def afail(value):
+        fail(value)
+
+    async def aidentity(value):
+        return value
+
+    def steps():
+        first = yield IO(lambda x: x, aidentity, (1,))
+        try:
+            yield IO(fail, afail, (2,))
+        except ValueError as e:
+            second, = e.args
+        third = yield IO.blocking(lambda x, y: x + y, 1, 2)
+        return first, second, third
+
+    assert run_io(steps()) == (1, 2, 3)
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(arun_io(steps())) == (1, 2, 3)
+    finally:
+        loop.close()
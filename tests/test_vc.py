@@ -1,9 +1,13 @@
+import os
+import shutil
 import subprocess
 from contextlib import suppress
 
 import pytest
 
-from bev.vc import SubprocessGit, TreeEntry
+from bev.native import NativeGit
+from bev.testing import create_structure
+from bev.vc import CatFileGit, SubprocessGit, TreeEntry
 
 
 def test_subprocess_git(temp_dir):
@@ -23,6 +27,12 @@ def test_subprocess_git(temp_dir):
     assert set(vc.list_dir('folder/nested', 'v1')) == {TreeEntry('a', False, False), TreeEntry('b', False, False)}
     with pytest.raises(FileNotFoundError):
         vc.list_dir('missing', 'v1')
+    with pytest.raises(FileNotFoundError):
+        vc.list_dir('folder/nested/a', 'v1')
+    assert vc.exists('folder/nested/a', 'v1')
+    assert vc.exists('folder/nested', 'v1')
+    assert not vc.exists('folder/missing', 'v1')
+    assert not vc.exists('folder', 'missing-version')
 
     # nested
     vc = SubprocessGit(nested.parent)
@@ -39,6 +49,223 @@ def test_subprocess_git(temp_dir):
         vc.list_dir('missing', 'v1')
 
 
+def test_find_hashes(git_repository):
+    vc = SubprocessGit(git_repository / 'bev-repo')
+    assert vc.find_hashes('v1') == []
+    assert vc.find_hashes('v2') == ['another.file.hash', 'folder/nested/a.npy.hash']
+    assert vc.find_hashes('v3') == ['folder/nested.hash']
+    assert vc.find_hashes('v4') == ['folder.hash']
+
+    vc = SubprocessGit(git_repository / 'bev-repo' / 'folder')
+    assert vc.find_hashes('v3') == ['nested.hash']
+    assert vc.find_hashes('v4') == []
+
+
+@pytest.mark.parametrize('cls', [SubprocessGit, CatFileGit, NativeGit])
+def test_resolve_version(temp_dir, cls):
+    def commit(name):
+        (temp_dir / name).touch()
+        subprocess.check_call(['git', 'add', '.'], cwd=temp_dir)
+        subprocess.check_call(['git', 'commit', '-m', name], cwd=temp_dir)
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=temp_dir).decode().strip()
+
+    subprocess.check_call(['git', 'init'], cwd=temp_dir)
+    first = commit('a')
+    subprocess.check_call(['git', 'tag', '-a', 'v1', '-m', 'v1'], cwd=temp_dir)
+
+    vc = cls(temp_dir)
+    vc.version_ttl = 1000
+    assert vc.resolve_version(first) == first
+    assert vc.resolve_version('v1') == vc.resolve_version('HEAD') == vc.resolve_version(first[:8]) == first
+    assert vc.resolve_version('missing') == 'missing'
+
+    second = commit('b')
+    # the branch is cached
+    assert vc.resolve_version('HEAD') == first
+    vc.version_ttl = 0
+    assert vc.resolve_version('HEAD') == second
+    assert vc.resolve_version('v1') == first
+    assert vc.exists('b', 'HEAD') and not vc.exists('b', 'v1')
+
+
+def test_cat_file_git(git_repository):
+    root = git_repository / 'bev-repo'
+    reference, vc = SubprocessGit(root), CatFileGit(root)
+    for version in ['v1', 'v2', 'v3', 'v4', 'missing-version']:
+        for relative in [
+            'just-a-file.txt', 'another.file.hash', 'folder/nested/a.npy.hash', 'folder/nested.hash',
+            'folder.hash', 'missing.hash', 'folder/missing/file',
+        ]:
+            assert vc.read(relative, version) == reference.read(relative, version), (relative, version)
+
+    # the process is restarted after a failure
+    vc.clear_caches()
+    vc._cat_file._process.kill()
+    assert vc.read('folder.hash', 'v4') == reference.read('folder.hash', 'v4')
+
+
+def test_disk_cache(git_repository, temp_dir):
+    shutil.copytree(git_repository, temp_dir / 'repo', symlinks=True)
+    cache, root = temp_dir / 'repo' / '.git' / 'bev-cache', temp_dir / 'repo' / 'bev-repo'
+    commit = SubprocessGit(root).resolve_version('v4')
+    paths = ['just-a-file.txt', 'folder.hash', 'missing.hash', 'folder/nested/a.npy.hash']
+
+    expected = {path: SubprocessGit(root).read(path, commit) for path in paths}
+    assert (cache / 'trees').exists() and (cache / 'blobs').exists()
+
+    def fail(*args, **kwargs):
+        raise AssertionError('git should not be called')
+
+    # a fresh instance, e.g. in another process, doesn't need git anymore
+    for cls in [SubprocessGit, CatFileGit]:
+        vc = cls(root)
+        vc._call_git = fail
+        assert {path: vc.read(path, commit) for path in paths} == expected
+        assert vc.list_dir('.', commit) == SubprocessGit(root).list_dir('.', commit)
+
+
+def test_disk_cache_size(git_repository, temp_dir, monkeypatch):
+    shutil.copytree(git_repository, temp_dir / 'repo', symlinks=True)
+    cache, root = temp_dir / 'repo' / '.git' / 'bev-cache', temp_dir / 'repo' / 'bev-repo'
+    shutil.rmtree(cache, ignore_errors=True)
+    reference = SubprocessGit(git_repository / 'bev-repo')
+    monkeypatch.setattr(SubprocessGit, 'disk_cache_size', 8192)
+
+    vc = SubprocessGit(root)
+    paths = ['just-a-file.txt', 'folder.hash', 'folder/nested/a.npy.hash', 'folder/nested/b.npy.hash']
+    for version in ['v1', 'v2', 'v3', 'v4']:
+        commit = vc.resolve_version(version)
+        assert [vc.read(path, commit) for path in paths] == [reference.read(path, commit) for path in paths]
+
+    # each of the caches is bounded
+    for name in ['trees', 'blobs']:
+        files = list((cache / name).glob('*/*'))
+        assert files
+        assert sum(path.stat().st_blocks * 512 for path in files) <= 8192
+
+
+@pytest.mark.parametrize('pack', [False, True])
+def test_native_git(git_repository, temp_dir, pack):
+    repo = temp_dir / 'repo'
+    shutil.copytree(git_repository, repo)
+    root = repo / 'bev-repo'
+    # a branch with a merge
+    git = lambda *args: subprocess.check_call(['git', *args], cwd=root, stdout=subprocess.DEVNULL)  # noqa
+    git('checkout', '-q', '-b', 'side', 'v2')
+    create_structure(root, {'side.txt': 'side', 'images/one.png': 'changed'})
+    git('add', '.')
+    git('commit', '-q', '-m', 'side')
+    git('checkout', '-q', '-')
+    git('merge', '-q', '--no-edit', 'side')
+    # similar contents produce deltas inside packs
+    for i in range(3):
+        create_structure(root, {'large.txt': '\n'.join(map(str, range(1000 + i)))})
+        git('add', '.')
+        git('commit', '-q', '-m', 'large')
+    git('tag', '-a', 'annotated', '-m', 'annotated')
+    if pack:
+        git('gc', '-q', '--aggressive')
+        git('pack-refs', '--all')
+
+    paths = [
+        '.', 'just-a-file.txt', 'another.file.hash', 'folder/nested/a.npy.hash', 'folder/nested.hash', 'folder',
+        'folder.hash', 'folder/file.txt', 'folder/nested', 'side.txt', 'images/one.png', 'images',
+        'large.txt', 'missing.hash', 'folder/missing/file',
+    ]
+    for nested in ['.', 'folder']:
+        reference, vc = SubprocessGit(root / nested), NativeGit(root / nested)
+        for version in ['v1', 'v2', 'v3', 'v4', 'side', 'HEAD', 'HEAD~1', 'HEAD~3^2', 'annotated', 'missing']:
+            for relative in paths:
+                if not relative.endswith(('.hash', '.txt')):
+                    assert same(vc.list_dir, reference.list_dir, relative, version), (relative, version)
+                else:
+                    assert vc.read(relative, version) == reference.read(relative, version), (relative, version)
+                assert vc.exists(relative, version) == reference.exists(relative, version), (relative, version)
+
+            assert vc.find_hashes(version) == reference.find_hashes(version), version
+
+    reference, vc = SubprocessGit(root), NativeGit(root)
+    for relative in paths:
+        for n in range(4):
+            assert vc.get_version(relative, n) == reference.get_version(relative, n), (relative, n)
+
+    # abbreviated commit ids
+    full = subprocess.check_output(['git', 'rev-parse', 'v3'], cwd=root).decode().strip()
+    vc = NativeGit(root)
+    assert vc.read('folder/nested.hash', full) == vc.read('folder/nested.hash', full[:7]) is not None
+
+
+def test_get_versions(temp_dir, monkeypatch):
+    def commit(message, files, *, merge=None):
+        env = {**os.environ, 'GIT_AUTHOR_DATE': f'{commit.time} +0000', 'GIT_COMMITTER_DATE': f'{commit.time} +0000'}
+        commit.time += 10
+        create_structure(temp_dir, files)
+        if merge is not None:
+            subprocess.check_call(['git', 'merge', '-q', '--no-commit', merge], cwd=temp_dir, env=env)
+        subprocess.check_call(['git', 'add', '.'], cwd=temp_dir, env=env)
+        subprocess.check_call(['git', 'commit', '-q', '-m', message], cwd=temp_dir, env=env)
+
+    commit.time = 1600000000
+    subprocess.check_call(['git', 'init', '-q'], cwd=temp_dir)
+    commit('first', {'a.hash': '1', 'folder/b.hash': '1', 'folder/c.hash': '1'})
+    commit('second', {'a.hash': '2'})
+    subprocess.check_call(['git', 'checkout', '-q', '-b', 'side'], cwd=temp_dir)
+    commit('side', {'folder/b.hash': '2', 'd.hash': '1'})
+    subprocess.check_call(['git', 'checkout', '-q', '-'], cwd=temp_dir)
+    commit('third', {'folder/c.hash': '2'})
+    commit('merge', {}, merge='side')
+    commit('fourth', {'a.hash': '3'})
+
+    def check(paths):
+        reference, vc = SubprocessGit(temp_dir), NativeGit(temp_dir)
+        latest = {relative: reference.get_version(relative) for relative in paths}
+        assert reference._get_versions(paths) == vc._get_versions(paths) == latest
+        assert reference.get_versions(paths) == latest
+        # memoized
+        assert vc.get_versions(paths[::-1]) == latest
+        return latest
+
+    latest = check(['.', 'a.hash', 'folder', 'folder/b.hash', 'folder/c.hash', 'd.hash', 'missing.hash'])
+    assert latest['missing.hash'] is None
+    assert list((temp_dir / '.git/bev-cache/latest').glob('*/*'))
+
+    # a merge that takes `x.hash` from the first parent and `y.hash` from the second one
+    commit('base', {'x.hash': '0', 'y.hash': '0'})
+    subprocess.check_call(['git', 'checkout', '-q', '-b', 'other'], cwd=temp_dir)
+    commit('s1', {'x.hash': '1'})
+    commit('s2', {'y.hash': '2'})
+    subprocess.check_call(['git', 'checkout', '-q', '-'], cwd=temp_dir)
+    commit('m1', {'z.hash': '1'})
+    subprocess.check_call(['git', 'merge', '-q', '--no-commit', 'other'], cwd=temp_dir)
+    subprocess.check_call(['git', 'checkout', 'HEAD', '--', 'x.hash'], cwd=temp_dir)
+    commit('merge-other', {})
+    latest = check(['x.hash', 'y.hash'])
+    messages = {
+        path: subprocess.check_output(['git', 'log', '-n', '1', '--format=%s', version], cwd=temp_dir).decode().strip()
+        for path, version in latest.items()
+    }
+    assert messages == {'x.hash': 'base', 'y.hash': 's2'}
+
+    # a single walk over the history, even with merges
+    paths = ['.', 'a.hash', 'folder/b.hash', 'd.hash', 'x.hash', 'y.hash', 'missing.hash']
+    latest = {relative: SubprocessGit(temp_dir).get_version(relative) for relative in paths}
+    calls = []
+    popen = subprocess.Popen
+    monkeypatch.setattr(subprocess, 'Popen', lambda *args, **kwargs: calls.append(args) or popen(*args, **kwargs))
+    assert SubprocessGit(temp_dir)._get_versions(paths) == latest
+    assert len(calls) == 1
+
+
+def same(a, b, *args):
+    def call(func):
+        try:
+            return func(*args)
+        except FileNotFoundError:
+            return FileNotFoundError
+
+    return call(a) == call(b)
+
+
 # @pytest.mark.xfail
 # @pytest.mark.parametrize('version', [
 #     '03b5b303e7a9e01e8023d2213cd53cccdca3b0c8',